@@ -0,0 +1,108 @@
+"""Microbenchmark: alpha-band content bounds vs the original NumPy implementation.
+
+    python benchmarks/bench_content_bounds.py [--repeat 5]
+
+Both versions are run over the same synthetic RGBA frames and must agree on
+the merged crop box before any timings are printed.
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from webm_sticker_engine import _scan_content_bounds  # noqa: E402
+
+CASES = [
+    ("emoji source", (128, 128), 30),
+    ("sticker source", (512, 512), 60),
+    ("1080p", (1920, 1080), 60),
+]
+
+
+def legacy_get_content_bounds(frame, border=0):
+    """The pre-vectorisation implementation, kept here as the baseline."""
+    if frame.mode != 'RGBA':
+        frame = frame.convert('RGBA')
+
+    img_array = np.array(frame)
+    alpha = img_array[:, :, 3]
+
+    non_transparent = np.where(alpha > 0)
+    if len(non_transparent[0]) == 0:
+        return None
+
+    y_min, y_max = np.min(non_transparent[0]), np.max(non_transparent[0])
+    x_min, x_max = np.min(non_transparent[1]), np.max(non_transparent[1])
+
+    y_min = max(0, y_min - border)
+    y_max = min(frame.size[1], y_max + border + 1)
+    x_min = max(0, x_min - border)
+    x_max = min(frame.size[0], x_max + border + 1)
+
+    return (x_min, y_min, x_max, y_max)
+
+
+def legacy_merged_bounds(frames, border):
+    bounds = None
+    for frame in frames:
+        frame_bounds = legacy_get_content_bounds(frame, border)
+        if frame_bounds:
+            if bounds is None:
+                bounds = frame_bounds
+            else:
+                bounds = (
+                    min(bounds[0], frame_bounds[0]),
+                    min(bounds[1], frame_bounds[1]),
+                    max(bounds[2], frame_bounds[2]),
+                    max(bounds[3], frame_bounds[3])
+                )
+    return bounds
+
+
+def make_frames(size, count):
+    """A blob drifting across a transparent canvas, like a typical sticker GIF."""
+    width, height = size
+    frames = []
+    for i in range(count):
+        frame = Image.new("RGBA", size, (0, 0, 0, 0))
+        x = width // 4 + (i * width // (2 * count))
+        ImageDraw.Draw(frame).ellipse((x, height // 4, x + width // 4, height * 3 // 4), fill=(200, 80, 40, 255))
+        frames.append(frame)
+    return frames
+
+
+def best_of(repeat, fn):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--border", type=int, default=2)
+    args = parser.parse_args(argv)
+
+    print(f"{'case':<16}{'frames':>8}{'legacy ms':>12}{'alpha ms':>12}{'speedup':>10}")
+    for label, size, count in CASES:
+        frames = make_frames(size, count)
+        expected = legacy_merged_bounds(frames, args.border)
+        actual = _scan_content_bounds(frames, args.border, cache_bytes=0)[0]
+        if tuple(map(int, expected)) != actual:
+            raise SystemExit(f"{label}: bounds differ, legacy={expected} alpha={actual}")
+
+        legacy = best_of(args.repeat, lambda: legacy_merged_bounds(frames, args.border))
+        alpha = best_of(args.repeat, lambda: _scan_content_bounds(frames, args.border, cache_bytes=0))
+        print(f"{label:<16}{count:>8}{legacy * 1000:>12.1f}{alpha * 1000:>12.1f}{legacy / alpha:>9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""Benchmark: ffmpeg subprocess vs in-process PyAV encoder backends on emoji batches.
+
+    python benchmarks/bench_encoders.py [--clips 8] [--repeat 3]
+
+Each clip of the batch is a synthetic animation resized to 100x100 and held
+in a RawFrameBuffer, then run through the full create_webm CRF search with
+every available backend. The table shows batch wall time, encode attempts,
+mean time per attempt and output sizes; the PyAV row is skipped with a note
+when PyAV is not installed.
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_pipeline import SEED, _draw_frame  # noqa: E402
+from webm_sticker_engine import ENCODER_BACKENDS, RawFrameBuffer, av, create_webm, resize_frame  # noqa: E402
+
+# Frame counts cycled through the batch (at 25 fps: 0.5 s to 2.95 s clips)
+CLIP_FRAMES = [12, 30, 48, 74]
+
+
+def make_batch(work_dir, clips):
+    """RawFrameBuffers for `clips` emoji-sized animations, plus their durations."""
+    rng = np.random.default_rng(SEED)
+    batch = []
+    for index in range(clips):
+        count = CLIP_FRAMES[index % len(CLIP_FRAMES)]
+        clip_dir = os.path.join(work_dir, f"clip{index}")
+        os.makedirs(clip_dir)
+        buffer = RawFrameBuffer(clip_dir)
+        for i in range(count):
+            buffer.append(resize_frame(_draw_frame(rng, (160, 160), i, count, True), False))
+        batch.append((buffer, count * 0.04))
+    return batch
+
+
+def run_backend(batch, output_dir, encoder):
+    history = []
+    sizes = []
+    start = time.perf_counter()
+    for index, (buffer, duration) in enumerate(batch):
+        outcome = create_webm(buffer, os.path.join(output_dir, f"{encoder}{index}.webm"), duration,
+                              True, False, encoder=encoder)
+        history += outcome.history
+        sizes.append(outcome.size_kb)
+    return {
+        "seconds": time.perf_counter() - start,
+        "attempts": len(history),
+        "attempt_ms": 1000 * sum(h["seconds"] for h in history) / len(history),
+        "mean_kb": sum(sizes) / len(sizes),
+        "max_kb": max(sizes),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--clips", type=int, default=8, help="emoji clips per batch")
+    parser.add_argument("--repeat", type=int, default=3, help="batch runs per backend (best of)")
+    args = parser.parse_args(argv)
+
+    backends = [name for name in ENCODER_BACKENDS if name != "pyav" or av is not None]
+    if av is None:
+        print("PyAV is not installed (pip install av); timing the ffmpeg backend only.")
+
+    work_dir = tempfile.mkdtemp(prefix="sticker-bench-encoders-")
+    try:
+        batch = make_batch(work_dir, args.clips)
+        rows = {}
+        for encoder in backends:
+            runs = [run_backend(batch, work_dir, encoder) for _ in range(args.repeat)]
+            rows[encoder] = min(runs, key=lambda row: row["seconds"])
+        for buffer, _ in batch:
+            buffer.close()
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    frames = sum(buffer.frame_count for buffer, _ in batch)
+    print(f"{args.clips} emoji clips, {frames} frames")
+    print(f"{'backend':<10}{'batch s':>9}{'clips/s':>9}{'attempts':>10}{'ms/attempt':>12}{'mean KB':>9}{'max KB':>8}")
+    for encoder, row in rows.items():
+        print(f"{encoder:<10}{row['seconds']:>9.2f}{args.clips / row['seconds']:>9.2f}{row['attempts']:>10}"
+              f"{row['attempt_ms']:>12.1f}{row['mean_kb']:>9.1f}{row['max_kb']:>8.1f}")
+    if len(rows) == 2:
+        print(f"pyav speedup: {rows['ffmpeg']['seconds'] / rows['pyav']['seconds']:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
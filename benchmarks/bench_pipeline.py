@@ -0,0 +1,250 @@
+"""End-to-end benchmark of the conversion pipeline on a generated corpus.
+
+    python benchmarks/bench_pipeline.py                 # run and compare with the baseline
+    python benchmarks/bench_pipeline.py --quick         # stickers/emoji, no crop, crf only
+    python benchmarks/bench_pipeline.py --save-baseline # record this machine's numbers
+
+The corpus is drawn from a fixed seed (animated GIF/WEBP of several frame
+counts, sizes and transparency, plus static PNG/JPEG), so every run converts
+identical inputs. Each target x crop x size-reduction combination reports
+files/s, frames/s, peak RSS, FFmpeg attempts and final sizes against the
+256 KB / 64 KB limits. Micro-timings of resize_frame, get_content_bounds and
+a single create_webm encode are measured as well.
+
+Results are compared with benchmarks/baselines/pipeline.json: slower timings
+beyond --tolerance, more encode attempts or outputs over the limit are
+reported as regressions (and fail the run with --check).
+"""
+import argparse
+import itertools
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from webm_sticker_cache import ffmpeg_version  # noqa: E402
+from webm_sticker_engine import (  # noqa: E402
+    ConversionSettings, RawFrameBuffer, convert_file, create_webm, get_content_bounds, resize_frame,
+)
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines", "pipeline.json")
+SEED = 20240917
+
+# name, format, (width, height), frames, transparent
+CORPUS = [
+    ("gif_small", "GIF", (128, 128), 12, True),
+    ("gif_long", "GIF", (320, 240), 90, True),
+    ("gif_opaque", "GIF", (400, 400), 30, False),
+    ("webp_anim", "WEBP", (256, 256), 24, True),
+    ("png_static", "PNG", (600, 400), 1, True),
+    ("jpeg_static", "JPEG", (640, 480), 1, False),
+]
+TARGETS = {"sticker": True, "emoji": False}
+CROP_MODES = ["No Crop", "2px Border"]
+METHODS = ["crf", "fps_50", "fps_25"]
+
+
+def _draw_frame(rng, size, index, count, transparent):
+    width, height = size
+    background = (0, 0, 0, 0) if transparent else (40, 60, 90, 255)
+    frame = Image.new("RGBA", size, background)
+    draw = ImageDraw.Draw(frame)
+    if not transparent:
+        noise = rng.integers(0, 40, (height, width, 3), dtype=np.uint8)
+        frame.paste(Image.fromarray(np.dstack([noise, np.full((height, width), 255, np.uint8)]), "RGBA"))
+    phase = index / max(count, 1)
+    for k in range(6):
+        x = int((width * 0.15) + (width * 0.5) * ((phase + k / 6) % 1))
+        y = int(height * (0.2 + 0.1 * k))
+        color = tuple(int(c) for c in rng.integers(60, 255, 3)) + (255,)
+        draw.ellipse((x, y, x + width // 5, y + height // 6), fill=color)
+    return frame
+
+
+def generate_corpus(directory):
+    """Write the deterministic corpus into directory; returns [(path, frame_count)]."""
+    rng = np.random.default_rng(SEED)
+    files = []
+    for name, fmt, size, count, transparent in CORPUS:
+        frames = [_draw_frame(rng, size, i, count, transparent) for i in range(count)]
+        extension = {"GIF": "gif", "WEBP": "webp", "PNG": "png", "JPEG": "jpg"}[fmt]
+        path = os.path.join(directory, f"{name}.{extension}")
+        if fmt == "JPEG":
+            frames[0].convert("RGB").save(path, quality=90)
+        elif count == 1:
+            frames[0].save(path)
+        elif fmt == "GIF":
+            frames[0].save(path, save_all=True, append_images=frames[1:], duration=40, loop=0, disposal=2)
+        else:
+            frames[0].save(path, save_all=True, append_images=frames[1:], duration=40, loop=0, lossless=True)
+        files.append((path, count))
+    return files
+
+
+def _best_of(repeat, fn):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def run_micro(corpus_dir, repeat):
+    """Per-call timings (ms) of the hot helpers on a 512px transparent frame."""
+    rng = np.random.default_rng(SEED)
+    frame = _draw_frame(rng, (640, 480), 3, 10, True)
+    results = {
+        "resize_frame_sticker_ms": _best_of(repeat, lambda: resize_frame(frame.copy(), True)) * 1000,
+        "resize_frame_emoji_ms": _best_of(repeat, lambda: resize_frame(frame.copy(), False)) * 1000,
+        "get_content_bounds_ms": _best_of(repeat, lambda: get_content_bounds(frame, 2)) * 1000,
+    }
+
+    work_dir = tempfile.mkdtemp(dir=corpus_dir)
+    try:
+        buffer = RawFrameBuffer(work_dir)
+        for i in range(30):
+            buffer.append(resize_frame(_draw_frame(rng, (128, 128), i, 30, True), False))
+        output = os.path.join(work_dir, "micro.webm")
+        results["create_webm_emoji_30f_ms"] = _best_of(
+            max(1, repeat // 5), lambda: create_webm(buffer, output, 1.2, True, False)) * 1000
+        buffer.close()
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return {key: round(value, 3) for key, value in results.items()}
+
+
+def run_matrix(files, output_dir, targets, crop_modes, methods):
+    rows = {}
+    for target, crop_mode, method in itertools.product(targets, crop_modes, methods):
+        settings = ConversionSettings(is_sticker=TARGETS[target], crop_mode=crop_mode, size_reduction=method)
+        label = f"{target}/{crop_mode}/{method}"
+        print(f"  {label} ...", file=sys.stderr)
+        results = []
+        start = time.perf_counter()
+        for path, _ in files:
+            results.append(convert_file(path, output_dir, settings))
+        elapsed = time.perf_counter() - start
+
+        failed = [os.path.basename(r.input_path) + ": " + r.error for r in results if not r.ok]
+        if failed:
+            raise SystemExit(f"{label} failed:\n  " + "\n  ".join(failed))
+        frames = sum(count for _, count in files)
+        sizes = {os.path.basename(r.input_path): round(r.encode.size_kb, 1) for r in results}
+        limit = results[0].encode.max_size_kb
+        peaks = [r.peak_memory_mb for r in results if r.peak_memory_mb is not None]
+        rows[label] = {
+            "seconds": round(elapsed, 3),
+            "files_per_s": round(len(results) / elapsed, 3),
+            "frames_per_s": round(frames / elapsed, 2),
+            "peak_rss_mb": round(max(peaks), 1) if peaks else None,
+            "attempts": sum(r.encode.attempts for r in results),
+            "limit_kb": limit,
+            "max_size_kb": max(sizes.values()),
+            "over_limit": sum(size > limit for size in sizes.values()),
+            "sizes_kb": sizes,
+        }
+    return rows
+
+
+def compare(current, baseline, tolerance):
+    """Human-readable regressions of current vs baseline."""
+    problems = []
+    for key, value in current["micro"].items():
+        old = baseline.get("micro", {}).get(key)
+        if old and value > old * (1 + tolerance):
+            problems.append(f"micro {key}: {old:.2f} -> {value:.2f} ms")
+    for label, row in current["matrix"].items():
+        old = baseline.get("matrix", {}).get(label)
+        if old is None:
+            continue
+        if row["seconds"] > old["seconds"] * (1 + tolerance):
+            problems.append(f"{label}: {old['seconds']:.2f}s -> {row['seconds']:.2f}s")
+        if row["attempts"] > old["attempts"]:
+            problems.append(f"{label}: encode attempts {old['attempts']} -> {row['attempts']}")
+        if row["over_limit"] > old["over_limit"]:
+            problems.append(f"{label}: outputs over {row['limit_kb']} KB {old['over_limit']} -> {row['over_limit']}")
+    return problems
+
+
+def print_table(report):
+    print(f"{'configuration':<28}{'files/s':>9}{'frames/s':>10}{'peak MB':>9}{'attempts':>10}{'max KB':>9}{'over':>6}")
+    for label, row in report["matrix"].items():
+        peak = f"{row['peak_rss_mb']:.0f}" if row["peak_rss_mb"] is not None else "-"
+        print(f"{label:<28}{row['files_per_s']:>9.2f}{row['frames_per_s']:>10.1f}{peak:>9}"
+              f"{row['attempts']:>10}{row['max_size_kb']:>7.1f}/{row['limit_kb']:<3}{row['over_limit']:>4}")
+    for key, value in report["micro"].items():
+        print(f"{key:<28}{value:>9.2f} ms")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the sticker/emoji pipeline on a synthetic corpus.")
+    parser.add_argument("--quick", action="store_true", help="only the no-crop crf configurations")
+    parser.add_argument("--repeat", type=int, default=20, help="repeats for micro-timings (best of)")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed slowdown vs baseline")
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--save-baseline", action="store_true", help="overwrite the baseline with this run")
+    parser.add_argument("--check", action="store_true", help="exit non-zero on regressions")
+    parser.add_argument("--json", help="also write this run's results to a file")
+    args = parser.parse_args(argv)
+
+    crop_modes = CROP_MODES[:1] if args.quick else CROP_MODES
+    methods = METHODS[:1] if args.quick else METHODS
+
+    work_dir = tempfile.mkdtemp(prefix="sticker-bench-")
+    try:
+        corpus_dir = os.path.join(work_dir, "corpus")
+        output_dir = os.path.join(work_dir, "out")
+        os.makedirs(corpus_dir)
+        os.makedirs(output_dir)
+        files = generate_corpus(corpus_dir)
+        report = {
+            "machine": {
+                "platform": platform.platform(),
+                "python": platform.python_version(),
+                "cpus": os.cpu_count(),
+                "ffmpeg": ffmpeg_version(),
+            },
+            "micro": run_micro(work_dir, args.repeat),
+            "matrix": run_matrix(files, output_dir, list(TARGETS), crop_modes, methods),
+        }
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    print_table(report)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(args.baseline), exist_ok=True)
+        with open(args.baseline, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Baseline saved to {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print("No baseline yet; run with --save-baseline to create one.")
+        return 0
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    if baseline.get("machine") != report["machine"]:
+        print("Note: baseline was recorded on a different machine/FFmpeg; timings are indicative only.")
+    problems = compare(report, baseline, args.tolerance)
+    for problem in problems:
+        print(f"REGRESSION {problem}")
+    if not problems:
+        print("No regressions against baseline.")
+    return 1 if problems and args.check else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
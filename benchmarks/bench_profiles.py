@@ -0,0 +1,87 @@
+"""Benchmark: wall time and output size of each libvpx-vp9 encoder profile.
+
+    python benchmarks/bench_profiles.py [--target sticker|emoji] [--encoder ffmpeg|pyav]
+
+Converts the synthetic corpus of bench_pipeline.py (CRF search, no crop)
+once per ENCODER_PROFILES entry, then once per faster search profile paired
+with a slower final profile. Sizes are compared with the default profile's
+outputs so the cost of each speed-up is visible per configuration. A
+smaller total paired with a higher mean CRF means the search settled on
+lower quality, not that the final profile compresses better.
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_pipeline import TARGETS, generate_corpus  # noqa: E402
+from webm_sticker_engine import (  # noqa: E402
+    DEFAULT_ENCODER_PROFILE, ENCODER_BACKENDS, ENCODER_PROFILES, ConversionSettings, convert_file,
+)
+
+
+def configurations():
+    """(label, final profile, search profile) for every profile and every faster-search pairing."""
+    names = list(ENCODER_PROFILES)
+    configs = [(name, name, None) for name in names]
+    for search_index, search in enumerate(names):
+        for final in names[search_index + 1:]:
+            configs.append((f"{search} -> {final}", final, search))
+    return configs
+
+
+def run_config(files, output_dir, is_sticker, encoder, profile, search_profile):
+    settings = ConversionSettings(is_sticker=is_sticker, encoder=encoder, encoder_profile=profile,
+                                  search_profile=search_profile)
+    start = time.perf_counter()
+    results = [convert_file(path, output_dir, settings) for path, _ in files]
+    elapsed = time.perf_counter() - start
+    failed = [f"{os.path.basename(r.input_path)}: {r.error}" for r in results if not r.ok]
+    if failed:
+        raise SystemExit("\n".join(failed))
+    return {
+        "seconds": elapsed,
+        "attempts": sum(r.encode.attempts for r in results),
+        "sizes": {os.path.basename(r.input_path): r.encode.size_kb for r in results},
+        "mean_crf": sum(r.encode.crf for r in results) / len(results),
+        "limit_kb": results[0].encode.max_size_kb,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--target", choices=list(TARGETS), default="sticker")
+    parser.add_argument("--encoder", choices=ENCODER_BACKENDS, default="ffmpeg")
+    args = parser.parse_args(argv)
+
+    work_dir = tempfile.mkdtemp(prefix="sticker-bench-profiles-")
+    try:
+        corpus_dir = os.path.join(work_dir, "corpus")
+        output_dir = os.path.join(work_dir, "out")
+        os.makedirs(corpus_dir)
+        os.makedirs(output_dir)
+        files = generate_corpus(corpus_dir)
+        rows = {}
+        for label, profile, search_profile in configurations():
+            print(f"  {label} ...", file=sys.stderr)
+            rows[label] = run_config(files, output_dir, TARGETS[args.target], args.encoder, profile, search_profile)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    reference = rows[DEFAULT_ENCODER_PROFILE]
+    print(f"{args.target}, {args.encoder} backend, {len(files)} files; size change vs {DEFAULT_ENCODER_PROFILE}")
+    print(f"{'profile':<34}{'wall s':>8}{'vs ref':>8}{'attempts':>10}{'total KB':>10}{'vs ref':>8}{'mean crf':>10}{'over':>6}")
+    for label, row in rows.items():
+        total = sum(row["sizes"].values())
+        reference_total = sum(reference["sizes"].values())
+        over = sum(size > row["limit_kb"] for size in row["sizes"].values())
+        print(f"{label:<34}{row['seconds']:>8.2f}{row['seconds'] / reference['seconds']:>7.2f}x{row['attempts']:>10}"
+              f"{total:>10.1f}{100 * (total / reference_total - 1):>+7.1f}%{row['mean_crf']:>10.1f}{over:>6}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""Benchmark: cost-ordered vs input-ordered scheduling of a batch over a worker pool.
+
+    python benchmarks/bench_schedule.py [--workers 4] [--target sticker|emoji] [--reduce crf|fps_50|fps_25]
+
+Uses the synthetic corpus of bench_pipeline.py plus a 600-frame GIF listed
+last, the straggler case. Every file is pre-scanned (timed against a full
+decode) and converted once on its own; the measured per-file times are then
+replayed through a greedy pool of --workers workers, in input order and in
+plan_batch's most-expensive-first order, to compare batch wall times
+independently of how many CPUs this machine has. Estimated and measured
+seconds are listed per file.
+"""
+import argparse
+import heapq
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_pipeline import SEED, TARGETS, _draw_frame, generate_corpus  # noqa: E402
+from webm_sticker_engine import SIZE_REDUCTION_METHODS, ConversionSettings, convert_file, plan_batch  # noqa: E402
+
+STRAGGLER = ((320, 240), 600)  # Size and frame count of the long GIF at the end of the batch
+
+
+def write_straggler(directory):
+    rng = np.random.default_rng(SEED + 1)
+    size, count = STRAGGLER
+    frames = [_draw_frame(rng, size, i, count, True) for i in range(count)]
+    path = os.path.join(directory, "zz_straggler.gif")
+    frames[0].save(path, save_all=True, append_images=frames[1:], duration=20, loop=0, disposal=2)
+    return path
+
+
+def makespan(order, seconds, workers):
+    """Wall time of a pool that hands each next file in order to the first free worker."""
+    free_at = [0.0] * workers
+    for path in order:
+        heapq.heappush(free_at, heapq.heappop(free_at) + seconds[path])
+    return max(free_at)
+
+
+def full_decode(paths):
+    for path in paths:
+        with Image.open(path) as image:
+            for index in range(getattr(image, "n_frames", 1)):
+                image.seek(index)
+                image.load()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--workers", type=int, default=4, help="pool size to simulate")
+    parser.add_argument("--target", choices=list(TARGETS), default="sticker")
+    parser.add_argument("--reduce", choices=SIZE_REDUCTION_METHODS, default="crf")
+    args = parser.parse_args(argv)
+
+    settings = ConversionSettings(is_sticker=TARGETS[args.target], size_reduction=args.reduce)
+    work_dir = tempfile.mkdtemp(prefix="sticker-bench-schedule-")
+    try:
+        corpus_dir = os.path.join(work_dir, "corpus")
+        output_dir = os.path.join(work_dir, "out")
+        os.makedirs(corpus_dir)
+        os.makedirs(output_dir)
+        paths = [path for path, _ in generate_corpus(corpus_dir)] + [write_straggler(corpus_dir)]
+
+        start = time.perf_counter()
+        plan = plan_batch(paths, settings)
+        scan_seconds = time.perf_counter() - start
+        start = time.perf_counter()
+        full_decode(paths)
+        decode_seconds = time.perf_counter() - start
+
+        seconds = {}
+        for path in paths:
+            print(f"  {os.path.basename(path)} ...", file=sys.stderr)
+            result = convert_file(path, output_dir, settings)
+            if not result.ok:
+                raise SystemExit(f"{os.path.basename(path)}: {result.error}")
+            seconds[path] = result.seconds
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    print(f"{len(paths)} files, {args.target}, {args.reduce}; pre-scan {scan_seconds * 1000:.1f} ms "
+          f"vs full decode {decode_seconds * 1000:.0f} ms")
+    print(f"{'file':<20}{'frames':>8}{'est s':>8}{'actual s':>10}")
+    for path, info, cost in plan.by_cost():
+        print(f"{os.path.basename(path):<20}{info.frame_count:>8}{cost:>8.2f}{seconds[path]:>10.2f}")
+    input_order = makespan(paths, seconds, args.workers)
+    cost_order = makespan([path for path, _, _ in plan.by_cost()], seconds, args.workers)
+    print(f"{args.workers} workers: input order {input_order:.2f} s, most expensive first {cost_order:.2f} s "
+          f"({input_order / cost_order:.2f}x); lower bound {max(sum(seconds.values()) / args.workers, max(seconds.values())):.2f} s")
+
+
+if __name__ == "__main__":
+    main()
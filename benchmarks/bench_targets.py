@@ -0,0 +1,106 @@
+"""Benchmark: one both-targets pass vs separate sticker and emoji runs.
+
+    python benchmarks/bench_targets.py [--crop "2px Border"] [--reduce crf|fps_50|fps_25]
+
+Converts the synthetic corpus of bench_pipeline.py three times: once as
+stickers, once as emoji, and once with both_targets (one decode and crop,
+emoji frames resized from the sticker frames, concurrent encodes). Prints
+wall time per mode, the speedup of the single pass over the two separate
+runs, and output sizes so the derived emoji can be compared with direct ones.
+It also checks that each derived emoji's first frame has the same content
+bounding box as the direct emoji (within BBOX_TOLERANCE pixels) and fails
+if it does not.
+"""
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_pipeline import generate_corpus  # noqa: E402
+from webm_sticker_engine import (  # noqa: E402
+    CROP_MODES, EMOJI_SIZE, SIZE_REDUCTION_METHODS, ConversionSettings, convert_batch,
+)
+
+BBOX_TOLERANCE = 2  # Pixels a derived emoji's content box may differ from the direct one's
+
+MODES = {
+    "sticker": {"is_sticker": True},
+    "emoji": {"is_sticker": False},
+    "both": {"both_targets": True},
+}
+
+
+def run_mode(files, output_dir, crop, reduce, options):
+    settings = ConversionSettings(crop_mode=crop, size_reduction=reduce, **options)
+    start = time.perf_counter()
+    results = list(convert_batch([path for path, _ in files], output_dir, settings))
+    elapsed = time.perf_counter() - start
+    failed = [f"{os.path.basename(r.input_path)} ({r.target}): {r.error}" for r in results if not r.ok]
+    if failed:
+        raise SystemExit("\n".join(failed))
+    sizes = {"sticker": 0.0, "emoji": 0.0}
+    emoji = {}
+    for result in results:
+        sizes[result.target] += result.encode.size_kb
+        if result.target == "emoji":
+            emoji[os.path.basename(result.input_path)] = first_frame_bbox(result.output_path)
+    return {"seconds": elapsed, "sizes": sizes, "emoji_bbox": emoji}
+
+
+def first_frame_bbox(path):
+    """Bounding box of the opaque pixels in an emoji WebM's first frame (libvpx-vp9 keeps the alpha)."""
+    data = subprocess.run(["ffmpeg", "-v", "error", "-c:v", "libvpx-vp9", "-i", path, "-frames:v", "1",
+                           "-f", "rawvideo", "-pix_fmt", "rgba", "-"], capture_output=True, check=True).stdout
+    alpha = np.frombuffer(data, np.uint8).reshape(EMOJI_SIZE[1], EMOJI_SIZE[0], 4)[..., 3]
+    ys, xs = np.nonzero(alpha > 127)
+    return (int(xs.min()), int(ys.min()), int(xs.max()) + 1, int(ys.max()) + 1) if xs.size else None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--crop", choices=CROP_MODES, default="No Crop")
+    parser.add_argument("--reduce", choices=SIZE_REDUCTION_METHODS, default="crf")
+    args = parser.parse_args(argv)
+
+    work_dir = tempfile.mkdtemp(prefix="sticker-bench-targets-")
+    try:
+        corpus_dir = os.path.join(work_dir, "corpus")
+        os.makedirs(corpus_dir)
+        files = generate_corpus(corpus_dir)
+        rows = {}
+        for mode, options in MODES.items():
+            print(f"  {mode} ...", file=sys.stderr)
+            output_dir = os.path.join(work_dir, mode)
+            os.makedirs(output_dir)
+            rows[mode] = run_mode(files, output_dir, args.crop, args.reduce, options)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    separate = rows["sticker"]["seconds"] + rows["emoji"]["seconds"]
+    print(f"{len(files)} files, {args.crop}, {args.reduce}")
+    print(f"{'mode':<10}{'wall s':>9}{'sticker KB':>12}{'emoji KB':>10}")
+    for mode, row in rows.items():
+        print(f"{mode:<10}{row['seconds']:>9.2f}{row['sizes']['sticker']:>12.1f}{row['sizes']['emoji']:>10.1f}")
+    print(f"both vs sticker + emoji: {separate:.2f} s -> {rows['both']['seconds']:.2f} s "
+          f"({separate / rows['both']['seconds']:.2f}x)")
+
+    mismatched = []
+    for name, direct in rows["emoji"]["emoji_bbox"].items():
+        derived = rows["both"]["emoji_bbox"][name]
+        if (direct is None) != (derived is None) or (
+                direct and max(abs(a - b) for a, b in zip(direct, derived)) > BBOX_TOLERANCE):
+            mismatched.append(f"{name}: direct {direct}, derived {derived}")
+    if mismatched:
+        raise SystemExit("derived emoji content differs from direct emoji:\n  " + "\n  ".join(mismatched))
+    print(f"derived emoji content boxes match direct ones (within {BBOX_TOLERANCE} px)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+"""Content-addressed on-disk cache of finished WebMs.
+
+Entries are keyed by a SHA-256 of the input bytes plus every setting that
+changes the output (and the FFmpeg build), so unchanged inputs in a re-run
+pack are copied straight from the cache instead of being re-encoded. Each
+entry is <key>.webm plus <key>.json holding the CRF/FPS that worked; the
+cache is trimmed least-recently-used first once it grows past max_bytes.
+"""
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+from functools import lru_cache
+
+DEFAULT_CACHE_MAX_MB = 512
+CACHE_FORMAT_VERSION = 5  # Bump when the engine changes what it writes for the same inputs
+
+
+@lru_cache(maxsize=None)
+def ffmpeg_version():
+    """First line of `ffmpeg -version`, or "unknown" if FFmpeg cannot be run."""
+    try:
+        out = subprocess.run(["ffmpeg", "-version"], capture_output=True, check=True).stdout
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+    lines = out.decode(errors="replace").splitlines()
+    return lines[0] if lines else "unknown"
+
+
+class OutputCache:
+    """A directory of cached WebMs with LRU eviction by file mtime."""
+
+    def __init__(self, cache_dir, max_bytes=DEFAULT_CACHE_MAX_MB * 1024 * 1024, link=False):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.link = link
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def key(self, input_path, options):
+        """Hash of the input file's bytes and the output-affecting options dict."""
+        digest = hashlib.sha256()
+        header = dict(options, ffmpeg=ffmpeg_version(), cache_format=CACHE_FORMAT_VERSION)
+        digest.update(json.dumps(header, sort_keys=True).encode())
+        with open(input_path, "rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def _paths(self, key):
+        base = os.path.join(self.cache_dir, key)
+        return base + ".webm", base + ".json"
+
+    def get(self, key, output_path):
+        """Place the cached WebM at output_path and return its metadata, or None on a miss."""
+        webm_path, meta_path = self._paths(key)
+        try:
+            with open(meta_path) as f:
+                meta = json.load(f)
+            self._place(webm_path, output_path)
+        except (OSError, ValueError):
+            return None
+        try:
+            os.utime(webm_path)
+        except OSError:
+            pass
+        return meta
+
+    def put(self, key, output_path, meta):
+        """Store a freshly written output under key, then evict down to max_bytes."""
+        webm_path, meta_path = self._paths(key)
+        tmp_webm = f"{webm_path}.{os.getpid()}.tmp"
+        try:
+            shutil.copyfile(output_path, tmp_webm)
+            with open(tmp_webm + ".json", "w") as f:
+                json.dump(meta, f)
+            os.replace(tmp_webm, webm_path)
+            os.replace(tmp_webm + ".json", meta_path)
+        finally:
+            for leftover in (tmp_webm, tmp_webm + ".json"):
+                if os.path.exists(leftover):
+                    os.remove(leftover)
+        self.evict()
+
+    def invalidate(self, key):
+        for path in self._paths(key):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def clear(self):
+        for name in os.listdir(self.cache_dir):
+            if name.endswith((".webm", ".json", ".tmp")):
+                try:
+                    os.remove(os.path.join(self.cache_dir, name))
+                except FileNotFoundError:
+                    pass
+
+    def evict(self):
+        """Drop least recently used entries until the cache fits in max_bytes."""
+        entries = []
+        total = 0
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith(".webm"):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.cache_dir, name))
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, name[:-len(".webm")]))
+            total += stat.st_size
+        for _, size, key in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            self.invalidate(key)
+            total -= size
+
+    def _place(self, webm_path, output_path):
+        # Rename into place rather than writing output_path directly: with link=True
+        # the output shares the cache entry's inode, and the engine likewise only
+        # ever replaces outputs by rename, so neither side truncates the other.
+        tmp_path = output_path + ".cache.part"
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        if self.link:
+            try:
+                os.link(webm_path, tmp_path)
+            except OSError:
+                shutil.copyfile(webm_path, tmp_path)
+        else:
+            shutil.copyfile(webm_path, tmp_path)
+        os.replace(tmp_path, output_path)
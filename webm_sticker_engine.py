@@ -0,0 +1,1571 @@
+"""GUI-free conversion engine for Telegram WebM stickers and emoji.
+
+The Tk app in webm_animated_sticker_emoji_maker_telegram.py is a thin front
+end over this module. It can also be run on its own for headless batches:
+
+    python webm_sticker_engine.py a.gif b.webp -o out --emoji --jobs 4
+"""
+import argparse
+import bisect
+import itertools
+import math
+import mmap
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, as_completed, wait
+from dataclasses import asdict, dataclass, field, replace
+from fractions import Fraction
+from typing import List, Optional
+
+import numpy as np
+from PIL import Image, ImageSequence
+
+try:
+    import av  # Optional: only needed for the in-process "pyav" encoder
+except ImportError:
+    av = None
+
+from webm_sticker_cache import DEFAULT_CACHE_MAX_MB, OutputCache, ffmpeg_version
+from webm_sticker_probe import DEFAULT_FRAME_MS, frame_durations, scan_input
+from webm_sticker_report import PROFILE_MODES, StageTimer, profile_call, stage, timed, write_report
+
+# Configuration
+MAX_SIZE_KB_STICKER = 256
+MAX_SIZE_KB_EMOJI = 64
+MAX_DURATION_ANIMATED = 2.95  # seconds for animated GIFs, strictly enforced
+MAX_DURATION_STATIC = 2.0  # seconds for static images
+STICKER_SIZE = 512  # One side must be 512 pixels
+EMOJI_SIZE = (100, 100)  # Exactly 100x100 pixels
+DEFAULT_FPS = 30  # Default frame rate for static images
+MAX_RESAMPLE_FPS = 30  # Finest output grid however short a frame's delay; Telegram's video sticker limit
+PIPE_SPILL_BYTES = 64 * 1024 * 1024  # Raw frames above this go to a memory-mapped file
+FRAME_CACHE_BYTES = 64 * 1024 * 1024  # Decoded frames kept between the crop pre-pass and main pass
+CRF_START = 30  # First libvpx-vp9 CRF tried
+CRF_MIN = 15  # Best quality the search will go down to
+CRF_MAX = 63  # libvpx-vp9 maximum
+CRF_FILL_TARGET = 0.9  # Stop searching once a fit uses this much of the size limit
+CRF_SIZE_SLOPE = 0.05  # Assumed drop in ln(size) per CRF step until two attempts are known
+MAX_CRF_ATTEMPTS = 5  # Search rounds; a round runs one encode, or several with max_parallel_encodes
+DEDUP_TOLERANCE = 2  # Max per-channel difference for consecutive frames to count as repeats
+FFMPEG_VFR_VERSION = (5, 1)  # Merged repeats need the concat "option" directive (5.0) and -fps_mode (5.1)
+CRF_SPECULATIVE_STEP = 6  # Widest CRF gap between candidates launched in the same round
+
+CROP_MODES = ["No Crop", "Full Crop", "1px Border", "2px Border", "3px Border"]
+SIZE_REDUCTION_METHODS = ["crf", "fps_50", "fps_25"]
+FPS_REDUCTION = {"fps_50": 0.5, "fps_25": 0.75}  # Output frame rate factor of each FPS method
+FRAME_TRANSPORTS = ["pipe", "png"]
+# Rough single-core seconds behind estimate_cost; job order and ETAs only depend on their ratios
+DECODE_SECONDS_PER_MPIXEL = 0.01  # Per megapixel of every source frame
+ENCODE_SECONDS = {True: (0.2, 0.06), False: (0.05, 0.015)}  # Sticker/emoji: (per file, per encoded frame)
+ENCODER_BACKENDS = ["ffmpeg", "pyav"]
+# libvpx-vp9 speed/quality trade-offs; threads are added per encode from encoder_threads.
+# tile-columns is log2 and clamped by libvpx to what the frame width allows (none for emoji).
+ENCODER_PROFILES = {
+    "fast draft": {"deadline": "realtime", "cpu-used": 8, "row-mt": 1, "tile-columns": 2},
+    "balanced": {"deadline": "good", "cpu-used": 2, "row-mt": 1, "tile-columns": 1},
+    "max compression": {"deadline": "good", "cpu-used": 0, "row-mt": 1, "tile-columns": 0},
+}
+DEFAULT_ENCODER_PROFILE = "balanced"
+
+class ConversionError(Exception):
+    """Raised when an input cannot be turned into a WebM."""
+
+
+class ConversionCancelled(ConversionError):
+    """Raised inside a conversion once its CancelToken has been cancelled."""
+
+
+class CancelToken:
+    """Stops conversions from another thread (e.g. a GUI's Cancel button).
+
+    cancel() kills every FFmpeg process registered with the token and makes
+    the frame pipeline raise ConversionCancelled at its next frame. Candidate
+    encodes only ever write .part files, so a cancelled file leaves no
+    partial output behind.
+    """
+
+    def __init__(self):
+        self._event = threading.Event()
+        self._jobs = set()
+        self._lock = threading.Lock()
+
+    @property
+    def cancelled(self):
+        return self._event.is_set()
+
+    def cancel(self):
+        with self._lock:
+            self._event.set()
+            jobs = list(self._jobs)
+        for job in jobs:
+            job.cancel()
+
+    def check(self):
+        if self._event.is_set():
+            raise ConversionCancelled("Cancelled")
+
+    def register(self, job):
+        with self._lock:
+            if not self._event.is_set():
+                self._jobs.add(job)
+                return
+        job.cancel()
+
+    def unregister(self, job):
+        with self._lock:
+            self._jobs.discard(job)
+
+
+def _check_cancel(cancel):
+    """cancel.check(), or nothing when the conversion cannot be cancelled."""
+    if cancel is not None:
+        cancel.check()
+
+
+@dataclass
+class ConversionSettings:
+    """Options shared by every file in a batch."""
+    is_sticker: bool = True
+    both_targets: bool = False  # Make a sticker and an emoji from each input (see convert_file_targets)
+    crop_mode: str = "No Crop"
+    size_reduction: str = "crf"
+    transport: str = "pipe"
+    encoder: str = "ffmpeg"  # See ENCODER_BACKENDS
+    encoder_profile: str = DEFAULT_ENCODER_PROFILE  # See ENCODER_PROFILES
+    search_profile: Optional[str] = None  # Profile for size-search attempts; None uses encoder_profile
+    encoder_threads: int = 0  # libvpx threads per encode; 0 splits the CPUs between parallel encodes
+    max_parallel_encodes: int = 1  # Candidate FFmpeg encodes run at once per file
+    batch_jobs: int = 1  # Files converted at once by convert_batch's pool; set by convert_batch
+    dedup_tolerance: Optional[int] = DEDUP_TOLERANCE  # None keeps every frame
+    cache_dir: Optional[str] = None  # Output cache is off unless a directory is given
+    cache_max_mb: int = DEFAULT_CACHE_MAX_MB
+    cache_link: bool = False  # Hard-link cache hits into place instead of copying
+    cache_refresh: bool = False  # Ignore existing entries and overwrite them
+    profile: Optional[str] = None  # "cprofile" or "tracemalloc"
+    profile_input: Optional[str] = None  # Path or file name of the one input to profile
+
+    @property
+    def do_crop(self):
+        return self.crop_mode != "No Crop"
+
+    @property
+    def border(self):
+        if self.crop_mode.endswith("px Border"):
+            return int(self.crop_mode.split("px")[0])
+        return 0
+
+
+@dataclass
+class EncodeOutcome:
+    """What create_webm settled on for one output."""
+    size_kb: float
+    max_size_kb: int
+    attempts: int
+    crf: int
+    fps: float
+    warning: Optional[str] = None
+    frames: int = 0  # Frames in the timeline
+    unique_frames: int = 0  # Frames actually sent to the encoder after de-duplication
+    history: List[dict] = field(default_factory=list)  # {"crf", "fps", "size_kb", "seconds"} per encode
+
+
+@dataclass
+class ConversionResult:
+    """Per-file result of convert_file; failures are recorded, not raised."""
+    input_path: str
+    output_path: Optional[str] = None
+    encode: Optional[EncodeOutcome] = None
+    error: Optional[str] = None
+    peak_memory_mb: Optional[float] = None
+    target: str = "sticker"  # "sticker" or "emoji"
+    cached: bool = False
+    cancelled: bool = False
+    seconds: float = 0.0
+    timings: dict = field(default_factory=dict)  # stage name -> seconds, see webm_sticker_report.STAGES
+
+    @property
+    def ok(self):
+        return self.error is None
+
+
+def _reset_peak_memory():
+    """Restart the peak-RSS counter where the OS allows it (Linux >= 4.0)."""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+
+def _peak_memory_mb():
+    """Peak resident set size of this process in MB, or None if unavailable."""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is bytes on macOS and KB elsewhere.
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def _report(progress, stage, message):
+    if progress is not None:
+        progress(stage, message)
+
+
+class _FrameWriter:
+    """Shared append and de-duplication logic of the frame sinks create_webm reads.
+
+    A frame whose channels all lie within dedup_tolerance of the last stored
+    frame is not stored again; that frame's repeat count grows instead. When
+    any frame repeats, input_args switches from a constant-rate sequence to a
+    concat script carrying per-frame durations, so FFmpeg decodes, filters
+    and encodes each distinct frame once. dedup_tolerance=None turns this off.
+    """
+
+    def __init__(self, work_dir, timer=None, dedup_tolerance=None, cancel=None):
+        self.work_dir = work_dir
+        self.timer = timer
+        self.dedup_tolerance = dedup_tolerance
+        self.cancel = cancel
+        self.size = None
+        self.frame_count = 0
+        self.repeats = []  # Consecutive copies of each stored frame
+        self._last = None
+        self._concat_args = None
+
+    @property
+    def is_variable(self):
+        return len(self.repeats) < self.frame_count
+
+    def append(self, frame, repeats=1):
+        """Add frame, shown for `repeats` consecutive frame intervals."""
+        _check_cancel(self.cancel)
+        with stage(self.timer, "serialise"):
+            if frame.mode != "RGBA":
+                frame = frame.convert("RGBA")
+            if self.size is None:
+                self.size = frame.size
+            elif frame.size != self.size:
+                raise ConversionError(f"Frame size changed from {self.size} to {frame.size} mid-sequence")
+
+            data = frame.tobytes()
+            if self.dedup_tolerance is None:
+                for _ in range(repeats):  # Dedup off: every interval is its own stored frame
+                    self._store(frame, data)
+                    self.repeats.append(1)
+            elif self._last is not None and self._matches_last(data):
+                self.repeats[-1] += repeats
+            else:
+                self._store(frame, data)
+                self.repeats.append(repeats)
+                self._last = data
+        self.frame_count += repeats
+
+    def _matches_last(self, data):
+        if data == self._last:
+            return True
+        if not self.dedup_tolerance:
+            return False
+        current = np.frombuffer(data, dtype=np.uint8).astype(np.int16)
+        previous = np.frombuffer(self._last, dtype=np.uint8)
+        return int(np.abs(current - previous).max()) <= self.dedup_tolerance
+
+    def input_args(self, frame_rate):
+        if not self.is_variable:
+            return self._sequence_args(frame_rate)
+        if self._concat_args is None:
+            self._concat_args = self._write_concat_script(frame_rate)
+        return self._concat_args
+
+    def _write_concat_script(self, frame_rate):
+        interval = 1 / frame_rate
+        entries = [(self._frame_file(i), repeats * interval) for i, repeats in enumerate(self.repeats)]
+        # The concat demuxer ignores the last entry's duration, so split one
+        # interval off the final frame and end on a duration-less repeat of it.
+        last_file, last_duration = entries[-1]
+        if self.repeats[-1] > 1:
+            entries[-1] = (last_file, last_duration - interval)
+            entries.append((last_file, interval))
+        entries.append((last_file, None))
+
+        lines = ["ffconcat version 1.0"]
+        for name, duration in entries:
+            # A fine image2 frame rate keeps concat from rounding durations to 1/25 s.
+            lines += [f"file '{name}'", "option framerate 1000"]
+            if duration is not None:
+                lines.append(f"duration {duration:.6f}")
+        script = os.path.join(self.work_dir, "frames.ffconcat")
+        with open(script, "w") as f:
+            f.write("\n".join(lines) + "\n")
+        return ["-f", "concat", "-safe", "0", "-i", script]
+
+    def stored_frames(self):
+        """Yield (RGBA image, repeats) for every stored frame, in order."""
+        for index, repeats in enumerate(self.repeats):
+            yield self._load(index), repeats
+
+    def stdin_data(self):
+        return None
+
+    def close(self):
+        pass
+
+
+class PngFrameWriter(_FrameWriter):
+    """Writes frames as numbered PNGs for FFmpeg's image2 demuxer."""
+
+    def _store(self, frame, data):
+        frame.save(os.path.join(self.work_dir, self._frame_file(len(self.repeats))), format="PNG")
+
+    def _frame_file(self, index):
+        return f"frame_{index:04d}.png"
+
+    def _load(self, index):
+        with Image.open(os.path.join(self.work_dir, self._frame_file(index))) as image:
+            return image.convert("RGBA")
+
+    def _sequence_args(self, frame_rate):
+        return ["-framerate", str(frame_rate), "-i", os.path.join(self.work_dir, "frame_%04d.png")]
+
+
+class RawFrameBuffer(_FrameWriter):
+    """Caches raw RGBA frames once and replays them to FFmpeg's stdin on every attempt.
+
+    Frames stay in memory up to spill_bytes; beyond that they are appended to a
+    file in work_dir that is memory-mapped for the replays. Variable-duration
+    sequences are written out once as uncompressed PAM files for the concat script.
+    """
+
+    def __init__(self, work_dir, spill_bytes=PIPE_SPILL_BYTES, timer=None, dedup_tolerance=None, cancel=None):
+        super().__init__(work_dir, timer, dedup_tolerance, cancel)
+        self.spill_bytes = spill_bytes
+        self._memory = bytearray()
+        self._file = None
+        self._map = None
+
+    def _store(self, frame, data):
+        if self._file is None and len(self._memory) + len(data) > self.spill_bytes:
+            self._file = open(os.path.join(self.work_dir, "frames.rgba"), "w+b")
+            self._file.write(self._memory)
+            self._memory = bytearray()
+        if self._file is not None:
+            self._file.write(data)
+        else:
+            self._memory += data
+
+    def _buffer(self):
+        if self._file is None:
+            return self._memory
+        if self._map is None:
+            self._file.flush()
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        return self._map
+
+    def _frame_file(self, index):
+        return f"frame_{index:04d}.pam"
+
+    def _load(self, index):
+        frame_bytes = self.size[0] * self.size[1] * 4
+        return Image.frombytes("RGBA", self.size, bytes(self._buffer()[index * frame_bytes:(index + 1) * frame_bytes]))
+
+    def _write_concat_script(self, frame_rate):
+        width, height = self.size
+        header = f"P7\nWIDTH {width}\nHEIGHT {height}\nDEPTH 4\nMAXVAL 255\nTUPLTYPE RGB_ALPHA\nENDHDR\n".encode()
+        frame_bytes = width * height * 4
+        buffer = memoryview(self._buffer())
+        try:
+            for index in range(len(self.repeats)):
+                with open(os.path.join(self.work_dir, self._frame_file(index)), "wb") as f:
+                    f.write(header)
+                    f.write(buffer[index * frame_bytes:(index + 1) * frame_bytes])
+        finally:
+            buffer.release()
+        return super()._write_concat_script(frame_rate)
+
+    def _sequence_args(self, frame_rate):
+        width, height = self.size
+        return ["-f", "rawvideo", "-pix_fmt", "rgba", "-s", f"{width}x{height}",
+                "-framerate", str(frame_rate), "-i", "pipe:0"]
+
+    def stdin_data(self):
+        return None if self.is_variable else self._buffer()
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        self._memory = bytearray()
+
+
+def _alpha_bbox(frame):
+    """Box (x_min, y_min, x_max, y_max) of pixels with alpha > 0, maxima exclusive; None if fully transparent."""
+    if frame.mode != 'RGBA':
+        frame = frame.convert('RGBA')
+    return frame.getchannel('A').getbbox()
+
+
+def _apply_border(bbox, size, border):
+    x_min, y_min, x_max, y_max = bbox
+    return (
+        max(0, x_min - border),
+        max(0, y_min - border),
+        min(size[0], x_max + border),
+        min(size[1], y_max + border),
+    )
+
+
+def get_content_bounds(frame, border=0):
+    """Get the bounding box of non-transparent content in a frame with optional border."""
+    bbox = _alpha_bbox(frame)
+    if bbox is None:
+        return None
+    return _apply_border(bbox, frame.size, border)
+
+
+def resize_to_fit(image, target_width, target_height):
+    """Resize image to fit within target dimensions while maintaining aspect ratio."""
+    orig_width, orig_height = image.size
+    target_ratio = target_width / target_height
+    img_ratio = orig_width / orig_height
+
+    if img_ratio > target_ratio:
+        new_width = target_width
+        new_height = int(target_width / img_ratio)
+    else:
+        new_height = target_height
+        new_width = int(target_height * img_ratio)
+
+    return image.resize((new_width, new_height), Image.Resampling.LANCZOS)
+
+
+class FrameSource:
+    """A single decode of one input: animation flag and frames.
+
+    Iterating yields RGBA copies of the frames lazily, one at a time. Once
+    resample() has planned the output timeline, frames it never shows are
+    skipped before their RGBA conversion.
+    """
+
+    def __init__(self, path, timer=None):
+        self.path = path
+        self.timer = timer
+        try:
+            self._image = Image.open(path)
+        except Exception as e:
+            raise ConversionError(f"Failed to open image: {e}")
+        self.is_animated = getattr(self._image, "is_animated", False)
+        self.n_frames = getattr(self._image, "n_frames", 1) if self.is_animated else 1
+        self._keep = None  # Per-frame flags from resample(); None yields every frame
+
+    def __iter__(self):
+        try:
+            yield from timed(self.timer, "decode", self._decode())
+        except ConversionError:
+            raise
+        except Exception as e:
+            raise ConversionError(f"Failed to read image frames: {e}")
+
+    def _decode(self):
+        for index, frame in enumerate(ImageSequence.Iterator(self._image)):
+            if self._keep is None or (index < len(self._keep) and self._keep[index]):
+                yield frame.convert('RGBA')
+
+    def resample(self, size_reduction="crf", merge_repeats=True):
+        """Plan the output Timeline for size_reduction and restrict iteration to the frames it shows."""
+        durations = None
+        if self.is_animated:
+            durations = frame_durations(self.path)
+            if durations is None or len(durations) != self.n_frames:
+                with stage(self.timer, "decode"):
+                    durations = self._decoded_durations()
+        timeline = plan_timeline(durations, size_reduction, self.is_animated, merge_repeats)
+        self._keep = [slots > 0 for slots in timeline.slots]
+        return timeline
+
+    def _decoded_durations(self):
+        # Formats without a header parser only report a frame's duration once it is loaded.
+        durations = []
+        try:
+            for frame in ImageSequence.Iterator(self._image):
+                frame.load()
+                durations.append(frame.info.get('duration', DEFAULT_FRAME_MS) / 1000)
+        except Exception as e:
+            raise ConversionError(f"Failed to read image frames: {e}")
+        return durations
+
+    def close(self):
+        self._image.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+@dataclass
+class Timeline:
+    """Output timing planned before any frame is decoded: a uniform grid of slots."""
+    duration: float  # Output seconds, capped at MAX_DURATION_ANIMATED / MAX_DURATION_STATIC
+    frame_rate: float  # Grid slots per second
+    slots: List[int]  # Slots each source frame is shown for; 0 means it is dropped
+
+    @property
+    def repeats(self):
+        """Slot counts of the frames that are shown, in order."""
+        return [slots for slots in self.slots if slots]
+
+
+def plan_timeline(durations, size_reduction="crf", is_animated=True, merge_repeats=True):
+    """Resample source frame durations (seconds) onto the grid the encoder will see.
+
+    Animations are sped up to fit MAX_DURATION_ANIMATED; static images are
+    shown for MAX_DURATION_STATIC at DEFAULT_FPS. In crf mode with
+    merge_repeats (the writer's dedup, which lets the encode keep variable
+    frame durations) the grid runs at the rate of the shortest frame, at
+    most MAX_RESAMPLE_FPS, so every frame keeps its timing. Otherwise each
+    slot is encoded as a frame of its own, so the grid runs at the source's
+    mean frame rate and never has more slots than the source has frames;
+    either way it is then scaled down by the FPS_REDUCTION of size_reduction.
+    Each slot shows the frame on screen at its start, so longer frames span
+    several slots and frames that fall between slots are dropped before they
+    are cropped, resized or encoded.
+    """
+    if is_animated:
+        if sum(durations) <= 0:
+            durations = [DEFAULT_FRAME_MS / 1000] * len(durations)
+        speed = max(1.0, sum(durations) / MAX_DURATION_ANIMATED)
+        durations = [duration / speed for duration in durations]
+        if size_reduction == "crf" and merge_repeats:
+            base_rate = min(1 / min(d for d in durations if d > 0), MAX_RESAMPLE_FPS)
+        else:
+            base_rate = min(len(durations) / sum(durations), MAX_RESAMPLE_FPS)
+    else:
+        durations = [MAX_DURATION_STATIC]
+        base_rate = DEFAULT_FPS
+    total = sum(durations)
+    count = round(total * base_rate * FPS_REDUCTION.get(size_reduction, 1.0))
+    count = max(1, min(count, math.floor(total * MAX_RESAMPLE_FPS + 1e-9)))  # Rounding must not exceed the cap
+    starts = list(itertools.accumulate(durations, initial=0.0))[:-1]
+    slots = [0] * len(durations)
+    for k in range(count):
+        slots[bisect.bisect_right(starts, k * total / count + 1e-9) - 1] += 1
+    return Timeline(duration=total, frame_rate=count / total, slots=slots)
+
+
+def _scan_content_bounds(source, border, cache_bytes=FRAME_CACHE_BYTES, timer=None):
+    """Pre-pass over source merging per-frame content bounds.
+
+    Returns (bounds, frames). Frames decoded here are kept for the main pass
+    while they fit in cache_bytes; past that they are dropped and frames is
+    source itself, to be decoded again one at a time.
+    """
+    # Union the raw alpha boxes and add the border once at the end; clipping to
+    # the frame commutes with the union, so this matches per-frame bordering.
+    bounds = None
+    size = None
+    cached = []
+    cached_bytes = 0
+    for frame in source:
+        size = frame.size
+        with stage(timer, "bounds"):
+            frame_bounds = _alpha_bbox(frame)
+
+        if frame_bounds:
+            if bounds is None:
+                bounds = frame_bounds
+            else:
+                bounds = (
+                    min(bounds[0], frame_bounds[0]),
+                    min(bounds[1], frame_bounds[1]),
+                    max(bounds[2], frame_bounds[2]),
+                    max(bounds[3], frame_bounds[3])
+                )
+
+        if cached is not None:
+            cached_bytes += frame.size[0] * frame.size[1] * 4
+            if cached_bytes <= cache_bytes:
+                cached.append(frame)
+            else:
+                cached = None
+    if bounds is not None:
+        bounds = _apply_border(bounds, size, border)
+    return bounds, (cached if cached is not None else source)
+
+
+def _crop_frames(frames, bounds):
+    for frame in frames:
+        yield frame.crop(bounds)
+
+
+def _fit_frames(frames, target_width, target_height):
+    """Resize each frame to fit and centre it on a transparent target-sized canvas."""
+    for frame in frames:
+        resized = resize_to_fit(frame, target_width, target_height)
+        canvas = Image.new('RGBA', (target_width, target_height), (0, 0, 0, 0))
+        offset_x = (target_width - resized.size[0]) // 2
+        offset_y = (target_height - resized.size[1]) // 2
+        canvas.paste(resized, (offset_x, offset_y))
+        yield canvas
+
+
+def _resize_frames(frames, is_sticker):
+    """Yield (resized frame, its content before padding) for each frame."""
+    for frame in frames:
+        content, target_size = _shrink_frame(frame, is_sticker)
+        yield _pad_frame(content, target_size), content
+
+
+def resize_frame(frame, is_sticker=True):
+    """Resize a single frame to Telegram sticker or emoji dimensions."""
+    return _pad_frame(*_shrink_frame(frame, is_sticker))
+
+
+def _shrink_frame(frame, is_sticker):
+    """frame as RGBA, shrunk (never enlarged) to fit the target; returns it with the target canvas size."""
+    if frame.mode != "RGBA":
+        frame = frame.convert("RGBA")
+
+    if is_sticker:
+        width, height = frame.size
+        aspect_ratio = width / height
+        if width >= height:
+            target_width = STICKER_SIZE
+            target_height = min(int(STICKER_SIZE / aspect_ratio), STICKER_SIZE)
+        else:
+            target_height = STICKER_SIZE
+            target_width = min(int(STICKER_SIZE * aspect_ratio), STICKER_SIZE)
+        target_size = (target_width, target_height)
+    else:
+        target_size = EMOJI_SIZE
+
+    frame.thumbnail(target_size, Image.Resampling.LANCZOS)
+    return frame, target_size
+
+
+def _pad_frame(frame, target_size):
+    new_frame = Image.new("RGBA", target_size, (0, 0, 0, 0))
+    offset = ((target_size[0] - frame.size[0]) // 2, (target_size[1] - frame.size[1]) // 2)
+    new_frame.paste(frame, offset)
+    return new_frame
+
+
+class _EncodeCancelled(Exception):
+    """An FFmpeg run was killed because its result is no longer needed."""
+
+
+class _FFmpegJob:
+    """One FFmpeg process that another thread can kill mid-encode."""
+
+    def __init__(self, cmd, stdin_data=None):
+        self.cmd = cmd
+        self.stdin_data = stdin_data
+        self.cancelled = False
+        self.seconds = 0.0
+        self._process = None
+        self._lock = threading.Lock()
+
+    def run(self):
+        start = time.perf_counter()
+        with self._lock:
+            if self.cancelled:
+                raise _EncodeCancelled()
+            try:
+                self._process = subprocess.Popen(
+                    self.cmd,
+                    stdin=subprocess.PIPE if self.stdin_data is not None else subprocess.DEVNULL,
+                    stdout=subprocess.DEVNULL,
+                    stderr=subprocess.PIPE,
+                )
+            except FileNotFoundError:
+                raise ConversionError("FFmpeg not found. Install it and add it to your PATH.")
+        _, stderr = self._process.communicate(self.stdin_data)
+        self.seconds = time.perf_counter() - start
+        if self.cancelled:
+            raise _EncodeCancelled()
+        if self._process.returncode != 0:
+            raise ConversionError(f"FFmpeg failed: {stderr.decode(errors='replace')}")
+
+    def cancel(self):
+        with self._lock:
+            self.cancelled = True
+            if self._process is not None and self._process.poll() is None:
+                self._process.kill()
+
+
+@dataclass
+class EncodeRequest:
+    """What create_webm needs encoded, fixed across all candidate encodes of one file."""
+    frames: object  # PngFrameWriter or RawFrameBuffer
+    frame_rate: float  # Input frames per second
+    speed: float  # Playback speed-up that squeezes the input into max_duration
+    max_duration: float
+    side: int  # Output is side x side, frames centred on transparency
+    is_animated: bool
+    variable_rate: bool  # Keep the frames' own durations instead of resampling to the encode fps
+
+
+class FFmpegEncoder:
+    """Default backend: one ffmpeg process per candidate encode."""
+
+    name = "ffmpeg"
+
+    def __init__(self, request):
+        self.request = request
+        self.input_args = request.frames.input_args(request.frame_rate)
+
+    def command(self, crf, fps, path, options):
+        request = self.request
+        scale = f"{request.side}:{request.side}"
+        # Reduced-fps modes resample to a constant rate; only the CRF search keeps input timestamps.
+        fps_filter = "" if request.variable_rate else f",fps={fps}"
+        loop_filter = ",loop=-1" if request.is_animated else ""
+        return [
+            "ffmpeg",
+            *self.input_args,
+            "-c:v", "libvpx-vp9",
+            "-b:v", "0",
+            "-crf", str(crf),
+            *[arg for name, value in options.items() for arg in (f"-{name}", str(value))],
+            "-vf", f"setpts={1/request.speed}*PTS{fps_filter},scale={scale}:force_original_aspect_ratio=decrease,pad={scale}:(ow-iw)/2:(oh-ih)/2:color=black@0{loop_filter}",
+            *(["-fps_mode", "vfr"] if request.variable_rate else []),
+            "-an",
+            # The concat script's end marker sits exactly at the end; -t must not cut it.
+            "-t", str(request.max_duration + 0.001),
+            "-f", "webm",
+            "-y",
+            path
+        ]
+
+    def job(self, crf, fps, path, options):
+        return _FFmpegJob(self.command(crf, fps, path, options), self.request.frames.stdin_data())
+
+
+class PyAVEncoder:
+    """In-process libvpx-vp9 through PyAV.
+
+    The stored frames are letterboxed and converted to yuva420p once; every
+    candidate then encodes them straight from memory, with no process spawn,
+    filter graph or frame files per attempt.
+    """
+
+    name = "pyav"
+
+    def __init__(self, request):
+        if av is None:
+            raise ConversionError("The pyav encoder needs PyAV: pip install av")
+        self.request = request
+        self.interval = 1 / (request.frame_rate * request.speed)  # Output seconds per input frame
+        self.images = []
+        self.starts = []
+        position = 0
+        for image, repeats in request.frames.stored_frames():
+            self.images.append(_letterbox(image, request.side))
+            self.starts.append(position * self.interval)
+            position += repeats
+        self.end = min(position * self.interval, request.max_duration)
+        self._spare = []  # Converted frame sets not in use by a running job
+        self._lock = threading.Lock()
+
+    def schedule(self, fps):
+        """([(seconds, stored frame index)], stream rate) for one candidate encode."""
+        if self.request.variable_rate:
+            points = [(start, index) for index, start in enumerate(self.starts) if start < self.end]
+            # The muxer gives the last frame one rate interval, so re-show it one interval
+            # before the end for the held frame to last until then.
+            tail = self.end - self.interval
+            if tail > points[-1][0] + 1e-6:
+                points.append((tail, bisect.bisect_right(self.starts, tail + 1e-6) - 1))
+            return points, 1 / self.interval
+        ticks = max(1, math.ceil(self.end * fps - 1e-6))
+        return [(k / fps, bisect.bisect_right(self.starts, k / fps + 1e-6) - 1) for k in range(ticks)], fps
+
+    def acquire_frames(self):
+        # Encoding reads each frame's pts, so concurrent candidates need their own frame objects.
+        with self._lock:
+            if self._spare:
+                return self._spare.pop()
+        return [av.VideoFrame.from_ndarray(image, format="rgba").reformat(format="yuva420p")
+                for image in self.images]
+
+    def release_frames(self, frames):
+        with self._lock:
+            self._spare.append(frames)
+
+    def job(self, crf, fps, path, options):
+        return _PyAVJob(self, crf, fps, path, options)
+
+
+class _PyAVJob:
+    """One in-process candidate encode; cancel() stops it at the next frame."""
+
+    def __init__(self, encoder, crf, fps, path, options):
+        self.encoder = encoder
+        self.crf = crf
+        self.fps = fps
+        self.path = path
+        self.options = options
+        self.cancelled = False
+        self.seconds = 0.0
+
+    def run(self):
+        start = time.perf_counter()
+        points, rate = self.encoder.schedule(self.fps)
+        side = self.encoder.request.side
+        frames = self.encoder.acquire_frames()
+        try:
+            with av.open(self.path, "w", format="webm") as container:
+                stream = container.add_stream("libvpx-vp9", rate=Fraction(rate).limit_denominator(1000))
+                stream.width = stream.height = side
+                stream.pix_fmt = "yuva420p"
+                stream.time_base = stream.codec_context.time_base = Fraction(1, 1000)
+                stream.options = {"crf": str(self.crf), "b": "0",
+                                  **{name: str(value) for name, value in self.options.items()}}
+                for seconds, index in points:
+                    if self.cancelled:
+                        raise _EncodeCancelled()
+                    frame = frames[index]
+                    frame.pts = round(seconds * 1000)
+                    container.mux(stream.encode(frame))
+                container.mux(stream.encode())
+        except av.FFmpegError as e:
+            raise ConversionError(f"PyAV encode failed: {e}")
+        finally:
+            self.encoder.release_frames(frames)
+            self.seconds = time.perf_counter() - start
+
+    def cancel(self):
+        self.cancelled = True
+
+
+ENCODERS = {encoder.name: encoder for encoder in (FFmpegEncoder, PyAVEncoder)}
+
+
+def ffmpeg_supports_vfr():
+    """Whether the installed FFmpeg can encode merged repeats; unparsed versions (git builds) are assumed to."""
+    match = re.search(r"version n?(\d+)\.(\d+)", ffmpeg_version())
+    return match is None or tuple(int(part) for part in match.groups()) >= FFMPEG_VFR_VERSION
+
+
+def _dedup_tolerance(settings):
+    """settings.dedup_tolerance, or None (every repeat stored, constant rate) when FFmpeg is too old for VFR."""
+    if settings.encoder == "ffmpeg" and not ffmpeg_supports_vfr():
+        return None
+    return settings.dedup_tolerance
+
+
+def _letterbox(image, side):
+    """RGBA array of image scaled to fit side x side and centred on transparency, like FFmpeg's scale+pad."""
+    if image.size != (side, side):
+        scale = min(side / image.width, side / image.height)
+        fitted = image.resize((max(1, int(image.width * scale)), max(1, int(image.height * scale))),
+                              Image.Resampling.BICUBIC)
+        image = Image.new("RGBA", (side, side), (0, 0, 0, 0))
+        image.paste(fitted, ((side - fitted.width) // 2, (side - fitted.height) // 2))
+    return np.asarray(image)
+
+
+def _crf_bracket(sizes, max_size_kb):
+    """(low, high) CRFs still worth trying given {crf: size_kb}, or None once the search is settled."""
+    fits = [crf for crf, size in sizes.items() if size <= max_size_kb]
+    misses = [crf for crf, size in sizes.items() if size > max_size_kb]
+    low = max(misses) + 1 if misses else CRF_MIN
+    high = min(fits) - 1 if fits else CRF_MAX
+    if low > high:
+        return None
+    if fits and sizes[min(fits)] >= max_size_kb * CRF_FILL_TARGET:
+        return None
+    return low, high
+
+
+def _next_crf(sizes, max_size_kb):
+    """Pick the next CRF to try from {crf: size_kb} of the encodes so far, or None to stop.
+
+    Sizes are modelled as log-linear in CRF: two bracketing (or nearest) attempts
+    are interpolated, a single attempt is extrapolated with CRF_SIZE_SLOPE. The
+    guess is clamped strictly between the best fitting and worst failing CRFs, so
+    the search always narrows.
+    """
+    if not sizes:
+        return CRF_START
+    bracket = _crf_bracket(sizes, max_size_kb)
+    if bracket is None:
+        return None
+    low, high = bracket
+
+    goal = math.log(max_size_kb * CRF_FILL_TARGET)
+    points = sorted(sizes.items(), key=lambda item: abs(math.log(item[1]) - goal))[:2]
+    (crf_a, size_a) = points[0]
+    slope = -CRF_SIZE_SLOPE
+    if len(points) == 2 and points[1][0] != crf_a:
+        (crf_b, size_b) = points[1]
+        measured = (math.log(size_b) - math.log(size_a)) / (crf_b - crf_a)
+        if measured < 0:
+            slope = measured
+    guess = round(crf_a + (goal - math.log(size_a)) / slope)
+    return min(max(guess, low), high)
+
+
+def _crf_candidates(sizes, max_size_kb, count):
+    """Up to count CRFs for the next round: the model's guess plus neighbours spread around it."""
+    guess = _next_crf(sizes, max_size_kb)
+    if guess is None:
+        return []
+    low, high = _crf_bracket(sizes, max_size_kb) if sizes else (CRF_MIN, CRF_MAX)
+    step = max(1, min(CRF_SPECULATIVE_STEP, (high - low) // max(count, 1)))
+    candidates = {guess}
+    offset = 1
+    while len(candidates) < count and (guess - offset * step >= low or guess + offset * step <= high):
+        for crf in (guess + offset * step, guess - offset * step):
+            if low <= crf <= high and len(candidates) < count:
+                candidates.add(crf)
+        offset += 1
+    return sorted(candidates)
+
+
+def create_webm(frames, output_path, duration, is_animated, is_sticker, size_reduction="crf", progress=None,
+                timer=None, max_parallel=1, cancel=None, encoder="ffmpeg", profile=DEFAULT_ENCODER_PROFILE,
+                search_profile=None, threads=0):
+    """Convert a PngFrameWriter/RawFrameBuffer to VP9 WebM, strictly enforcing duration.
+
+    `encoder` names the backend in ENCODERS that runs each candidate encode,
+    `profile` the ENCODER_PROFILES entry it encodes with. A different
+    `search_profile` runs the size search with that (usually faster) profile
+    and only re-encodes the chosen CRF/FPS with `profile`; that final encode
+    is kept if it fits the limit or is no larger than the searched one.
+    threads=0 gives each of the max_parallel encodes an equal share of the CPUs.
+
+    With max_parallel > 1 each search round launches that many candidate
+    encodes at once and kills the ones a finished candidate makes pointless.
+    When the frames carry merged repeats (frames.is_variable) the CRF search
+    encodes them variable-frame-rate, so every held frame is coded once.
+    The fps_50/fps_25 methods expect frames already resampled to their rate
+    (see plan_timeline) and only lower it further if the first try is too big.
+    Cancelling `cancel` kills the running encodes and raises ConversionCancelled.
+    """
+    max_duration = MAX_DURATION_ANIMATED if is_animated else MAX_DURATION_STATIC
+    max_size_kb = MAX_SIZE_KB_STICKER if is_sticker else MAX_SIZE_KB_EMOJI
+    total_duration = min(duration, max_duration)
+    frame_count = frames.frame_count
+    fps = frame_count / total_duration
+    backend = ENCODERS[encoder](EncodeRequest(
+        frames=frames,
+        frame_rate=frame_count / duration,
+        speed=duration / max_duration if duration > max_duration else 1.0,
+        max_duration=max_duration,
+        side=STICKER_SIZE if is_sticker else EMOJI_SIZE[0],
+        is_animated=is_animated,
+        variable_rate=frames.is_variable and size_reduction == "crf",
+    ))
+    threads = threads or max(1, (os.cpu_count() or 1) // max_parallel)
+    search_profile = search_profile or profile
+    history = []
+
+    def run_round(candidates, prune, profile_name=search_profile):
+        """Encode {key: (crf, fps, path)} concurrently; returns {key: size_kb} of those not cancelled.
+
+        prune(key, size_kb, running_keys) names running candidates made useless by a result.
+        """
+        _check_cancel(cancel)
+        options = dict(ENCODER_PROFILES[profile_name], threads=threads)
+        jobs = {key: backend.job(crf, encode_fps, path, options)
+                for key, (crf, encode_fps, path) in candidates.items()}
+        if cancel is not None:
+            for job in jobs.values():
+                cancel.register(job)
+        sizes = {}
+        with stage(timer, "encode"), ThreadPoolExecutor(max_workers=len(jobs)) as pool:
+            futures = {pool.submit(job.run): key for key, job in jobs.items()}
+            pending = set(futures)
+            try:
+                while pending:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        key = futures[future]
+                        try:
+                            future.result()
+                        except _EncodeCancelled:
+                            continue
+                        crf, encode_fps, path = candidates[key]
+                        sizes[key] = os.path.getsize(path) / 1024
+                        history.append({"crf": crf, "fps": encode_fps, "size_kb": sizes[key],
+                                        "seconds": jobs[key].seconds, "profile": profile_name})
+                        running = [futures[f] for f in pending]
+                        for other in prune(key, sizes[key], running):
+                            jobs[other].cancel()
+            finally:
+                if pending:  # An encode failed; don't wait for the rest.
+                    for job in jobs.values():
+                        job.cancel()
+                if cancel is not None:
+                    for job in jobs.values():
+                        cancel.unregister(job)
+        _check_cancel(cancel)
+        return sizes
+
+    def prune_crf(crf, size_kb, running):
+        # Sizes fall as CRF rises: a fit makes higher CRFs pointless, a miss lower ones.
+        if size_kb <= max_size_kb:
+            return [other for other in running if other > crf]
+        return [other for other in running if other < crf]
+
+    def prune_fps(step, size_kb, running):
+        # A fit at one frame rate makes every lower frame rate pointless.
+        return [other for other in running if other > step] if size_kb <= max_size_kb else []
+
+    # Every candidate gets its own file so the best fit survives later, worse tries.
+    parts = set()
+    try:
+        if size_reduction == "crf":
+            sizes = {}
+            rounds = 0
+            candidates = _crf_candidates(sizes, max_size_kb, max_parallel)
+            while candidates and rounds < MAX_CRF_ATTEMPTS:
+                rounds += 1
+                label = "/".join(str(crf) for crf in candidates)
+                _report(progress, "encode", f"Converting with CRF={label} (round {rounds})...")
+                paths = {crf: f"{output_path}.crf{crf}.part" for crf in candidates}
+                parts.update(paths.values())
+                sizes.update(run_round({crf: (crf, fps, paths[crf]) for crf in candidates}, prune_crf))
+                candidates = _crf_candidates(sizes, max_size_kb, max_parallel)
+            fits = [c for c, size in sizes.items() if size <= max_size_kb]
+            crf = min(fits) if fits else max(sizes)
+            chosen_part, chosen_kb = f"{output_path}.crf{crf}.part", sizes[crf]
+            over_limit = f"WebM exceeds {max_size_kb} KB. Using highest compression."
+            current_fps = fps
+        else:
+            crf = CRF_START
+            max_attempts = 3
+            steps = [fps * 0.75 ** i for i in range(max_attempts)]
+            sizes = {}
+            next_step = 0
+            while next_step < max_attempts and not any(size <= max_size_kb for size in sizes.values()):
+                batch = list(range(next_step, min(next_step + max_parallel, max_attempts)))
+                next_step = batch[-1] + 1
+                label = "/".join(f"{steps[i]:.1f}" for i in batch)
+                _report(progress, "encode", f"Converting with FPS={label}...")
+                paths = {i: f"{output_path}.fps{i}.part" for i in batch}
+                parts.update(paths.values())
+                sizes.update(run_round({i: (crf, steps[i], paths[i]) for i in batch}, prune_fps))
+            fits = [i for i, size in sizes.items() if size <= max_size_kb]
+            chosen = min(fits) if fits else max(sizes)
+            chosen_part, chosen_kb = f"{output_path}.fps{chosen}.part", sizes[chosen]
+            over_limit = f"WebM exceeds {max_size_kb} KB after FPS reduction."
+            current_fps = steps[chosen]
+
+        if search_profile != profile:
+            _report(progress, "encode", f"Final encode with the {profile} profile...")
+            final_part = f"{output_path}.final.part"
+            parts.add(final_part)
+            final_kb = run_round({"final": (crf, current_fps, final_part)}, lambda *_: [], profile)["final"]
+            if final_kb <= max_size_kb or final_kb <= chosen_kb:
+                chosen_part = final_part
+        os.replace(chosen_part, output_path)
+    finally:
+        for part in parts:
+            if os.path.exists(part):
+                os.remove(part)
+
+    size_kb = os.path.getsize(output_path) / 1024
+    return EncodeOutcome(
+        size_kb=size_kb,
+        max_size_kb=max_size_kb,
+        attempts=len(history),
+        crf=crf,
+        fps=current_fps,
+        warning=over_limit if size_kb > max_size_kb else None,
+        frames=frame_count,
+        unique_frames=len(frames.repeats),
+        history=history,
+    )
+
+
+def _cache_options(settings, is_sticker):
+    """Settings and engine tunables that change the bytes written for an input."""
+    return {
+        "is_sticker": is_sticker,
+        "derived": settings.both_targets and not is_sticker,  # Emoji resized from the sticker frames
+        "crop_mode": settings.crop_mode,
+        "size_reduction": settings.size_reduction,
+        "encoder": settings.encoder if settings.encoder == "ffmpeg" else f"{settings.encoder} {av and av.__version__}",
+        "dedup_tolerance": settings.dedup_tolerance,
+        "profiles": [ENCODER_PROFILES[settings.encoder_profile],
+                     settings.search_profile and ENCODER_PROFILES[settings.search_profile]],
+        "crf_search": [CRF_START, CRF_MIN, CRF_MAX, CRF_FILL_TARGET, CRF_SIZE_SLOPE, MAX_CRF_ATTEMPTS,
+                       CRF_SPECULATIVE_STEP, settings.max_parallel_encodes],
+    }
+
+
+def open_cache(settings):
+    """The OutputCache configured by settings, or None when caching is off."""
+    if not settings.cache_dir:
+        return None
+    return OutputCache(settings.cache_dir, settings.cache_max_mb * 1024 * 1024, link=settings.cache_link)
+
+
+def convert_file(input_path, output_folder, settings, progress=None, cancel=None):
+    """Convert one input into output_folder/<name>.webm.
+
+    Never raises for per-file problems; they end up in ConversionResult.error.
+    A conversion stopped through `cancel` comes back with cancelled=True and
+    leaves no output file. settings.both_targets is ignored here; use
+    convert_file_targets to get both outputs.
+    """
+    return _convert_targets(input_path, output_folder, settings, [settings.is_sticker], progress, cancel)[0]
+
+
+def convert_file_targets(input_path, output_folder, settings, progress=None, cancel=None):
+    """Convert one input for every target settings asks for; returns a ConversionResult per target.
+
+    With settings.both_targets the input is decoded, resampled and cropped
+    once: frames are made at sticker resolution, the emoji frames are
+    resized from those, and the two encodes run concurrently. The outputs
+    are <name>_sticker.webm and <name>_emoji.webm. Stages shared by both
+    targets are timed on the sticker result.
+    """
+    return _convert_targets(input_path, output_folder, settings, _targets(settings), progress, cancel)
+
+
+def _targets(settings):
+    """is_sticker for each output settings asks for per input."""
+    return [True, False] if settings.both_targets else [settings.is_sticker]
+
+
+def _convert_targets(input_path, output_folder, settings, targets, progress, cancel):
+    name = os.path.basename(input_path)
+    base = os.path.join(output_folder, os.path.splitext(name)[0])
+    results = []
+    for is_sticker in targets:
+        target = "sticker" if is_sticker else "emoji"
+        output_path = f"{base}_{target}.webm" if len(targets) > 1 else f"{base}.webm"
+        results.append(ConversionResult(input_path=input_path, output_path=output_path, target=target))
+    if cancel is not None and cancel.cancelled:
+        for result in results:
+            result.error = "Cancelled"
+            result.cancelled = True
+            result.output_path = None
+        return results
+    _report(progress, "start", f"Processing {name}...")
+    _reset_peak_memory()
+
+    cache = None
+    keys = {}
+    try:
+        cache = open_cache(settings)
+        if cache is not None:
+            for is_sticker, result in zip(targets, results):
+                keys[result.target] = cache.key(input_path, _cache_options(settings, is_sticker))
+            metas = [None if settings.cache_refresh else cache.get(keys[result.target], result.output_path)
+                     for result in results]
+            if all(meta is not None for meta in metas):
+                for result, meta in zip(results, metas):
+                    result.encode = EncodeOutcome(**meta)
+                    result.cached = True
+                _report(progress, "done", f"Reused cached {name}")
+                return results
+    except OSError as e:
+        for result in results:
+            result.error = f"Cache unavailable: {e}"
+            result.output_path = None
+        return results
+
+    start = time.perf_counter()
+    jobs = list(zip(targets, results))
+    if settings.profile and _is_profile_target(input_path, settings):
+        profile_call(settings.profile, base, _convert_uncached, input_path, jobs, settings, progress, cancel)
+    else:
+        _convert_uncached(input_path, jobs, settings, progress, cancel)
+    seconds = time.perf_counter() - start
+    peak_memory_mb = _peak_memory_mb()
+    for result in results:
+        result.seconds = seconds if result is results[0] else 0.0
+        result.peak_memory_mb = peak_memory_mb
+        if not result.ok:
+            result.output_path = None
+        elif cache is not None:
+            try:
+                cache.put(keys[result.target], result.output_path, asdict(result.encode))
+            except OSError as e:
+                _report(progress, "cache", f"Could not cache {name}: {e}")
+    return results
+
+
+def _is_profile_target(input_path, settings):
+    target = settings.profile_input
+    if not target:
+        return True
+    return os.path.abspath(input_path) == os.path.abspath(target) or os.path.basename(input_path) == target
+
+
+def _prefixed(progress, label):
+    """A progress callback that tags each message with label, for concurrent targets."""
+    if progress is None:
+        return None
+    return lambda stage_name, message: progress(stage_name, f"{label}: {message}")
+
+
+def _record_failure(result, error, progress, name):
+    result.error = str(error)
+    if isinstance(error, ConversionCancelled):
+        result.cancelled = True
+        _report(progress, "cancelled", f"Cancelled {name}")
+    else:
+        _report(progress, "failed", f"Processing failed for {name}")
+
+
+def _convert_uncached(input_path, jobs, settings, progress, cancel=None):
+    """Decode and process input_path once, then encode it for each (is_sticker, result) in jobs.
+
+    Frames are made at the first target's size; later targets resize them
+    further instead of going back to the source. Several targets are encoded
+    concurrently, each on its own StageTimer merged into its result.
+    """
+    name = os.path.basename(input_path)
+    timer = StageTimer()
+    temp_dir = tempfile.mkdtemp()
+    dedup_tolerance = _dedup_tolerance(settings)
+    writers = []
+    for index in range(len(jobs)):
+        work_dir = os.path.join(temp_dir, str(index))
+        os.makedirs(work_dir)
+        if settings.transport == "pipe":
+            writers.append(RawFrameBuffer(work_dir, timer=timer, dedup_tolerance=dedup_tolerance,
+                                          cancel=cancel))
+        else:
+            writers.append(PngFrameWriter(work_dir, timer=timer, dedup_tolerance=dedup_tolerance,
+                                          cancel=cancel))
+    source = None
+    try:
+        try:
+            source = FrameSource(input_path, timer)
+            primary = jobs[0][0]
+            target_width = STICKER_SIZE if primary else EMOJI_SIZE[0]
+            target_height = STICKER_SIZE if primary else EMOJI_SIZE[1]
+            timeline = source.resample(settings.size_reduction, dedup_tolerance is not None)
+
+            # Every path only sees the frames the timeline shows, each appended once with its slot count.
+            if settings.do_crop:
+                _report(progress, "frames", f"Cropping {name}...")
+                bounds, frames = _scan_content_bounds(source, settings.border, timer=timer)
+                if bounds is None:
+                    raise ConversionError("No non-transparent content found")
+                # Fitting scales the content up or down to fill the canvas, so later targets can resize it whole.
+                frames = ((frame, frame) for frame in
+                          _fit_frames(_crop_frames(frames, bounds), target_width, target_height))
+            else:
+                _report(progress, "frames", f"Processing frames for {name}...")
+                frames = _resize_frames(source, primary)
+            derived = [None] * len(jobs)
+            # Later targets resize the content before padding: small sources are never enlarged onto the
+            # first target's canvas, so resizing that whole canvas would shrink them further.
+            for (frame, content), repeats in zip(timed(timer, "resize", frames), timeline.repeats):
+                stored = len(writers[0].repeats)
+                writers[0].append(frame, repeats)
+                for index in range(1, len(jobs)):
+                    # A frame merged into the previous one at full size is shown as the previous derived frame.
+                    if derived[index] is None or len(writers[0].repeats) > stored:
+                        with stage(timer, "resize"):
+                            derived[index] = resize_frame(content, jobs[index][0])
+                    writers[index].append(derived[index], repeats)
+            if not writers[0].frame_count:
+                raise ConversionError("No frames could be decoded")
+        except Exception as e:
+            for _, result in jobs:
+                _record_failure(result, e, progress, name)
+            return
+
+        # Concurrent targets share the CPUs with the other files of the batch and the parallel
+        # candidate encodes; with fewer CPUs than encodes they would only contend, so they run
+        # one after the other.
+        cpus = os.cpu_count() or 1
+        encodes = settings.batch_jobs * settings.max_parallel_encodes
+        workers = max(1, min(len(jobs), cpus // encodes))
+        threads = settings.encoder_threads or max(1, cpus // (workers * encodes))
+
+        def encode(index):
+            is_sticker, result = jobs[index]
+            encode_timer = timer if len(jobs) == 1 else StageTimer()
+            target_progress = progress if len(jobs) == 1 else _prefixed(progress, result.target.capitalize())
+            try:
+                result.encode = create_webm(writers[index], result.output_path, timeline.duration,
+                                            source.is_animated, is_sticker, settings.size_reduction,
+                                            target_progress, encode_timer, settings.max_parallel_encodes,
+                                            cancel, settings.encoder, settings.encoder_profile,
+                                            settings.search_profile, threads)
+                _report(target_progress, "done", "Conversion complete!")
+            except Exception as e:
+                _record_failure(result, e, target_progress, name)
+            if encode_timer is not timer:
+                result.timings = encode_timer.stages
+
+        if workers == 1:
+            for index in range(len(jobs)):
+                encode(index)
+        else:
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                list(pool.map(encode, range(len(jobs))))
+    finally:
+        if source is not None:
+            source.close()
+        for writer in writers:
+            writer.close()
+        shutil.rmtree(temp_dir, ignore_errors=True)
+        first = jobs[0][1]
+        first.timings = {key: timer.stages.get(key, 0.0) + first.timings.get(key, 0.0)
+                         for key in {*timer.stages, *first.timings}}
+
+
+def estimate_cost(info, settings):
+    """Rough single-core seconds to convert a pre-scanned input, for job ordering and ETAs.
+
+    Decoding scales with every source pixel; encoding with the frames left
+    after resampling (dedup can only lower that) per target, plus a fixed
+    cost per target for encoder start-up and the size search.
+    """
+    durations = info.durations or [DEFAULT_FRAME_MS / 1000] * info.frame_count
+    timeline = plan_timeline(durations, settings.size_reduction, info.is_animated,
+                             _dedup_tolerance(settings) is not None)
+    encoded = sum(1 for slots in timeline.slots if slots)
+    cost = info.width * info.height * info.frame_count / 1e6 * DECODE_SECONDS_PER_MPIXEL
+    for is_sticker in _targets(settings):
+        per_file, per_frame = ENCODE_SECONDS[is_sticker]
+        cost += per_file + per_frame * encoded
+    return cost
+
+
+@dataclass
+class BatchPlan:
+    """A pre-scanned batch: convertible inputs with their estimated cost, and the rejected ones."""
+    entries: List[tuple] = field(default_factory=list)  # (path, InputInfo, cost), in input order
+    rejected: List[tuple] = field(default_factory=list)  # (path, reason)
+
+    @property
+    def total_cost(self):
+        return sum(cost for _, _, cost in self.entries)
+
+    def cost(self, path):
+        return next((cost for entry_path, _, cost in self.entries if entry_path == path), 0.0)
+
+    def by_cost(self):
+        """Entries most expensive first, so a pool never ends on one big file started last."""
+        return sorted(self.entries, key=lambda entry: entry[2], reverse=True)
+
+    def eta(self, elapsed, done_cost):
+        """Seconds left, extrapolating elapsed over the estimated cost of the files finished so far."""
+        if done_cost <= 0:
+            return None
+        return elapsed / done_cost * max(0.0, self.total_cost - done_cost)
+
+
+def plan_batch(input_paths, settings):
+    """Pre-scan input_paths from their headers alone into a BatchPlan for convert_batch."""
+    plan = BatchPlan()
+    for path in input_paths:
+        try:
+            info = scan_input(path)
+        except ValueError as e:
+            plan.rejected.append((path, str(e)))
+        else:
+            plan.entries.append((path, info, estimate_cost(info, settings)))
+    return plan
+
+
+def convert_batch(input_paths, output_folder, settings, jobs=1, progress=None, cancel=None, plan=None):
+    """Convert many inputs, yielding a ConversionResult per file as each finishes.
+
+    Inputs are pre-scanned first (or taken from `plan`, a plan_batch result
+    for input_paths): rejected ones are yielded as failures before any
+    conversion starts. With jobs > 1 files are spread over a process pool,
+    most expensive first; progress callbacks only fire for in-process
+    (jobs == 1) runs since they cannot cross processes. Once `cancel` is
+    cancelled no further files are started; in-process runs also stop the
+    current file, pool workers finish the files they hold.
+    """
+    if plan is None:
+        plan = plan_batch(input_paths, settings)
+    for path, reason in plan.rejected:
+        _report(progress, "failed", f"Skipped {os.path.basename(path)}: {reason}")
+        yield from _failed_results(path, reason, settings)
+
+    input_paths = [path for path, _, _ in plan.entries]
+    pooled = jobs > 1 and len(input_paths) > 1
+    if settings.batch_jobs != (jobs if pooled else 1):
+        settings = replace(settings, batch_jobs=jobs if pooled else 1)
+    if not pooled:
+        for input_path in input_paths:
+            if cancel is not None and cancel.cancelled:
+                return
+            yield from convert_file_targets(input_path, output_folder, settings, progress, cancel)
+        return
+
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        futures = {pool.submit(convert_file_targets, path, output_folder, settings): path
+                   for path, _, _ in plan.by_cost()}
+        for future in as_completed(futures):
+            if cancel is not None and cancel.cancelled:
+                for pending in futures:
+                    pending.cancel()
+            if future.cancelled():
+                continue
+            try:
+                yield from future.result()
+            except Exception as e:
+                # The worker itself died (e.g. killed by the OS), not just the conversion.
+                yield from _failed_results(futures[future], f"Worker failed: {e}", settings)
+
+
+def _failed_results(input_path, error, settings):
+    """One failed ConversionResult per target, for inputs that never reach _convert_targets."""
+    return [ConversionResult(input_path=input_path, error=error, target="sticker" if is_sticker else "emoji")
+            for is_sticker in _targets(settings)]
+
+
+def _format_eta(seconds):
+    return f"{int(seconds // 60)}:{int(seconds % 60):02d}"
+
+
+def _format_result(result):
+    name = os.path.basename(result.input_path)
+    if not result.ok:
+        return f"FAIL {name} ({result.target}): {result.error}"
+    encode = result.encode
+    if result.cached:
+        return (f"OK   {name} -> {os.path.basename(result.output_path)} "
+                f"{encode.size_kb:.1f}/{encode.max_size_kb} KB, crf={encode.crf}, fps={encode.fps:.1f}, cached")
+    line = (f"OK   {name} -> {os.path.basename(result.output_path)} "
+            f"{encode.size_kb:.1f}/{encode.max_size_kb} KB, crf={encode.crf}, "
+            f"fps={encode.fps:.1f}, attempts={encode.attempts}")
+    if encode.unique_frames < encode.frames:
+        line += f", frames={encode.unique_frames}/{encode.frames} unique"
+    if result.peak_memory_mb is not None:
+        line += f", peak={result.peak_memory_mb:.0f} MB"
+    if encode.warning:
+        line += f" WARNING: {encode.warning}"
+    return line
+
+
+def build_arg_parser():
+    parser = argparse.ArgumentParser(description="Convert images to Telegram WebM stickers or emoji.")
+    parser.add_argument("inputs", nargs="+", help="GIF, PNG, JPEG or WEBP files")
+    parser.add_argument("-o", "--output", required=True, help="output folder (created if missing)")
+    target = parser.add_mutually_exclusive_group()
+    target.add_argument("--sticker", dest="is_sticker", action="store_true", default=True,
+                        help="512px-side stickers, <=256 KB (default)")
+    target.add_argument("--emoji", dest="is_sticker", action="store_false",
+                        help="100x100 emoji, <=64 KB")
+    target.add_argument("--both", dest="both_targets", action="store_true",
+                        help="a sticker and an emoji per input from one decode (<name>_sticker/_emoji.webm)")
+    parser.add_argument("--crop", choices=CROP_MODES, default="No Crop", help="transparent border cropping")
+    parser.add_argument("--reduce", choices=SIZE_REDUCTION_METHODS, default="crf",
+                        help="how to get under the size limit")
+    parser.add_argument("--transport", choices=FRAME_TRANSPORTS, default="pipe",
+                        help="feed FFmpeg raw frames over stdin (default) or through PNG files")
+    parser.add_argument("--encoder", choices=ENCODER_BACKENDS, default="ffmpeg",
+                        help="run encodes as ffmpeg processes (default) or in-process through PyAV")
+    parser.add_argument("--speed", dest="encoder_profile", choices=list(ENCODER_PROFILES),
+                        default=DEFAULT_ENCODER_PROFILE, help="libvpx-vp9 speed/compression profile")
+    parser.add_argument("--search-speed", dest="search_profile", choices=list(ENCODER_PROFILES),
+                        help="run the size search with this profile and only the final encode with --speed")
+    parser.add_argument("--threads", type=int, default=0,
+                        help="libvpx threads per encode (default: CPUs / (jobs x parallel encodes))")
+    parser.add_argument("--dedup-tolerance", type=int, default=DEDUP_TOLERANCE,
+                        help="max per-channel difference for consecutive frames to be merged into one")
+    parser.add_argument("--no-dedup", action="store_true", help="encode every frame, even exact repeats")
+    parser.add_argument("--cache-dir", help="reuse outputs of unchanged inputs from this cache folder")
+    parser.add_argument("--cache-max-mb", type=int, default=DEFAULT_CACHE_MAX_MB,
+                        help="evict least recently used cache entries beyond this size")
+    parser.add_argument("--cache-link", action="store_true", help="hard-link cache hits instead of copying")
+    parser.add_argument("--refresh-cache", action="store_true",
+                        help="re-convert the given inputs and replace their cache entries")
+    parser.add_argument("--clear-cache", action="store_true", help="empty the cache folder before converting")
+    parser.add_argument("--report", help="write per-file stage timings to this .json or .csv file")
+    parser.add_argument("--profile", choices=PROFILE_MODES,
+                        help="profile one file's conversion; stats are saved next to its output")
+    parser.add_argument("--profile-input", help="which input to profile (path or file name; default: the first)")
+    parser.add_argument("-j", "--jobs", type=int, default=1, help="files to convert in parallel")
+    parser.add_argument("--parallel-encodes", type=int, default=1,
+                        help="candidate encodes to run at once per file (capped so jobs x this x targets <= CPUs)")
+    return parser
+
+
+def main(argv=None):
+    args = build_arg_parser().parse_args(argv)
+    settings = ConversionSettings(is_sticker=args.is_sticker, both_targets=args.both_targets, crop_mode=args.crop,
+                                  size_reduction=args.reduce, transport=args.transport, encoder=args.encoder,
+                                  encoder_profile=args.encoder_profile, search_profile=args.search_profile,
+                                  dedup_tolerance=None if args.no_dedup else args.dedup_tolerance,
+                                  cache_dir=args.cache_dir, cache_max_mb=args.cache_max_mb,
+                                  cache_link=args.cache_link, cache_refresh=args.refresh_cache,
+                                  profile=args.profile, profile_input=args.profile_input)
+    cpus = os.cpu_count() or 1
+    targets = 2 if args.both_targets else 1
+    settings.max_parallel_encodes = max(1, min(args.parallel_encodes, cpus // (max(args.jobs, 1) * targets)))
+    encodes = max(args.jobs, 1) * settings.max_parallel_encodes * targets
+    settings.encoder_threads = args.threads or max(1, cpus // encodes)
+    if settings.max_parallel_encodes < args.parallel_encodes:
+        print(f"Limiting --parallel-encodes to {settings.max_parallel_encodes} "
+              f"({cpus} CPUs / {args.jobs} jobs / {targets} targets)", file=sys.stderr)
+    if settings.dedup_tolerance is not None and _dedup_tolerance(settings) is None:
+        print(f"FFmpeg older than {'.'.join(map(str, FFMPEG_VFR_VERSION))}: repeated frames are encoded "
+              f"one by one, as with --no-dedup", file=sys.stderr)
+    if args.clear_cache:
+        if not args.cache_dir:
+            print("--clear-cache needs --cache-dir", file=sys.stderr)
+            return 2
+        open_cache(settings).clear()
+
+    input_paths = []
+    for path in args.inputs:
+        if os.path.exists(path):
+            input_paths.append(path)
+        else:
+            print(f"SKIP {path}: file not found", file=sys.stderr)
+    if not input_paths:
+        print("No valid input files found.", file=sys.stderr)
+        return 2
+    os.makedirs(args.output, exist_ok=True)
+    if settings.profile and not settings.profile_input:
+        settings.profile_input = input_paths[0]
+
+    def progress(stage, message):
+        print(f"  {message}", file=sys.stderr)
+
+    plan = plan_batch(input_paths, settings)
+    print(f"Pre-scan: {len(plan.entries)} to convert, {len(plan.rejected)} rejected, "
+          f"est. {_format_eta(plan.total_cost)} on one core", file=sys.stderr)
+    results = []
+    expected = (len(plan.entries) + len(plan.rejected)) * len(_targets(settings))
+    done_cost = 0.0
+    start = time.perf_counter()
+    for result in convert_batch(input_paths, args.output, settings, jobs=args.jobs,
+                                progress=progress if args.jobs <= 1 else None, plan=plan):
+        print(_format_result(result))
+        results.append(result)
+        done_cost += plan.cost(result.input_path) / len(_targets(settings))
+        remaining = plan.eta(time.perf_counter() - start, done_cost)
+        if remaining is not None and len(results) < expected:
+            print(f"  ETA {_format_eta(remaining)}", file=sys.stderr)
+    if args.report:
+        write_report(results, args.report, time.perf_counter() - start)
+    return 1 if any(not result.ok for result in results) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,149 @@
+"""Header-level inspection of inputs, without decoding any pixels.
+
+Pillow only knows a GIF or WebP frame's duration once it has decoded that
+frame. frame_durations reads them straight from the container instead (GIF
+Graphic Control Extensions, WebP ANMF chunks), so the engine can plan its
+temporal resampling before the first frame is decoded. scan_input adds the
+format, dimensions and frame count Pillow reads when opening a file, which
+is enough to reject unusable inputs and estimate a batch's cost up front.
+Truncation is only caught for GIF, WebP and PNG, whose container structure
+is walked; a cut-off JPEG or TIFF still passes and fails when decoded.
+"""
+import os
+import struct
+from dataclasses import dataclass
+from typing import Optional, Tuple
+
+from PIL import Image
+
+DEFAULT_FRAME_MS = 100  # Pillow's (and the engine's) duration for frames that carry none
+
+
+@dataclass
+class InputInfo:
+    """What scan_input learned about a file without decoding it."""
+    path: str
+    format: str
+    width: int
+    height: int
+    frame_count: int
+    durations: Optional[Tuple[float, ...]] = None  # Per-frame seconds, when the headers carry them
+
+    @property
+    def is_animated(self):
+        return self.frame_count > 1
+
+
+def scan_input(path):
+    """InputInfo for path, or ValueError saying why it cannot be converted.
+
+    No pixels are decoded: Pillow's lazy open gives format, size and frame
+    count; GIF blocks and WebP chunks are walked for per-frame delays and,
+    with PNG's end chunk, to reject files that end early. Other formats are
+    only checked for a readable header.
+    """
+    try:
+        if os.path.getsize(path) == 0:
+            raise ValueError("Empty file")
+    except OSError as e:
+        raise ValueError(f"Cannot read file: {e.strerror or e}")
+    try:
+        with Image.open(path) as image:
+            image_format = image.format or "unknown"
+            width, height = image.size
+            frame_count = getattr(image, "n_frames", 1) if getattr(image, "is_animated", False) else 1
+    except Exception as e:
+        raise ValueError(f"Not a supported image: {e}")
+    if not width or not height or not frame_count:
+        raise ValueError(f"Image has no pixels ({width}x{height}, {frame_count} frames)")
+
+    with open(path, "rb") as f:
+        data = f.read()
+    if _is_truncated(data):
+        raise ValueError(f"Truncated {image_format} file")
+    durations = _container_durations(data) if frame_count > 1 else None
+    if durations is not None and len(durations) != frame_count:
+        durations = None  # The engine falls back to decoder-reported durations too
+    return InputInfo(path, image_format, width, height, frame_count, durations and tuple(durations))
+
+
+def frame_durations(path):
+    """Per-frame durations in seconds read from the file's headers, or None if they can't be.
+
+    None covers formats without a header parser here (e.g. APNG, TIFF),
+    non-animated WebP and files too malformed to walk; callers fall back
+    to durations reported by the decoder.
+    """
+    with open(path, "rb") as f:
+        return _container_durations(f.read())
+
+
+def _container_durations(data):
+    try:
+        if data[:6] in (b"GIF87a", b"GIF89a"):
+            return _gif_durations(data)
+        if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+            return _webp_durations(data)
+    except (IndexError, struct.error):
+        pass
+    return None
+
+
+def _is_truncated(data):
+    """Whether a GIF, WebP or PNG ends before its container does; other formats are not checked."""
+    try:
+        if data[:6] in (b"GIF87a", b"GIF89a"):
+            _gif_durations(data)  # Runs off the end of data inside a cut block
+        elif data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+            return struct.unpack_from("<I", data, 4)[0] + 8 > len(data)
+        elif data[:8] == b"\x89PNG\r\n\x1a\n":
+            return data.rfind(b"IEND") < 0
+    except (IndexError, struct.error):
+        return True
+    return False
+
+
+def _skip_sub_blocks(data, pos):
+    """Position just past the GIF data sub-block chain starting at pos."""
+    while data[pos]:
+        pos += data[pos] + 1
+    return pos + 1
+
+
+def _gif_durations(data):
+    pos = 13
+    flags = data[10]
+    if flags & 0x80:  # Global color table
+        pos += 3 << ((flags & 7) + 1)
+    durations = []
+    delay_ms = None
+    while pos < len(data) and data[pos] != 0x3B:  # Trailer
+        block = data[pos]
+        if block == 0x21:  # Extension
+            if data[pos + 1] == 0xF9 and data[pos + 2] >= 4:  # Graphic Control Extension
+                delay_ms = struct.unpack_from("<H", data, pos + 4)[0] * 10
+            pos = _skip_sub_blocks(data, pos + 2)
+        elif block == 0x2C:  # Image descriptor
+            flags = data[pos + 9]
+            pos += 10
+            if flags & 0x80:  # Local color table
+                pos += 3 << ((flags & 7) + 1)
+            pos = _skip_sub_blocks(data, pos + 1)  # LZW minimum code size, then image data
+            durations.append((DEFAULT_FRAME_MS if delay_ms is None else delay_ms) / 1000)
+            delay_ms = None  # Like Pillow, a delay only applies to the image that follows it
+        else:
+            return None
+    return durations or None
+
+
+def _webp_durations(data):
+    pos = 12
+    durations = []
+    while pos + 8 <= len(data):
+        fourcc = data[pos:pos + 4]
+        (size,) = struct.unpack_from("<I", data, pos + 4)
+        if fourcc == b"ANMF":
+            # Payload: X, Y, width-1, height-1 and duration (ms) as 24-bit little-endian fields.
+            durations.append(int.from_bytes(data[pos + 20:pos + 23], "little") / 1000)
+        pos += 8 + size + (size & 1)
+    return durations or None
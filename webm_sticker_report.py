@@ -0,0 +1,154 @@
+"""Per-stage timing, run reports and opt-in profiling for the conversion engine.
+
+StageTimer attributes wall time to named pipeline stages (decode, bounds,
+resize, serialise, encode). Stages nest, and each one only counts its own
+time: while a resize stage pulls the next frame from a decode stage, that
+time goes to decode. write_report turns a batch of ConversionResults into a
+JSON or CSV file with per-file and per-stage totals.
+"""
+import cProfile
+import csv
+import json
+import os
+import time
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+
+STAGES = ["decode", "bounds", "resize", "serialise", "encode"]
+PROFILE_MODES = ["cprofile", "tracemalloc"]
+
+
+class StageTimer:
+    """Accumulates exclusive wall time per stage for one file."""
+
+    def __init__(self):
+        self.stages = {}
+        self._stack = []
+        self._resumed = None
+
+    def _charge(self, now):
+        if self._stack:
+            name = self._stack[-1]
+            self.stages[name] = self.stages.get(name, 0.0) + now - self._resumed
+        self._resumed = now
+
+    @contextmanager
+    def stage(self, name):
+        self._charge(time.perf_counter())
+        self._stack.append(name)
+        try:
+            yield
+        finally:
+            self._charge(time.perf_counter())
+            self._stack.pop()
+
+    def timed(self, name, iterable):
+        """Re-yield iterable, charging the time spent producing each item to name."""
+        iterator = iter(iterable)
+        while True:
+            with self.stage(name):
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+            yield item
+
+
+def stage(timer, name):
+    """timer.stage(name), or a no-op context when timing is off."""
+    return timer.stage(name) if timer is not None else nullcontext()
+
+
+def timed(timer, name, iterable):
+    """timer.timed(name, iterable), or iterable unchanged when timing is off."""
+    return timer.timed(name, iterable) if timer is not None else iterable
+
+
+def _file_row(result):
+    encode = result.encode
+    return {
+        "input": result.input_path,
+        "target": result.target,
+        "output": result.output_path,
+        "ok": result.ok,
+        "error": result.error,
+        "cached": result.cached,
+        "seconds": round(result.seconds, 4),
+        "stages": {name: round(seconds, 4) for name, seconds in result.timings.items()},
+        "size_kb": round(encode.size_kb, 2) if encode else None,
+        "max_size_kb": encode.max_size_kb if encode else None,
+        "crf": encode.crf if encode else None,
+        "fps": round(encode.fps, 3) if encode else None,
+        "frames": encode.frames if encode else None,
+        "unique_frames": encode.unique_frames if encode else None,
+        "attempts": encode.history if encode and not result.cached else [],
+        "peak_memory_mb": result.peak_memory_mb,
+    }
+
+
+def write_report(results, path, wall_seconds):
+    """Write per-file timings plus batch totals to path (.csv, otherwise JSON)."""
+    rows = [_file_row(result) for result in results]
+    totals = {name: 0.0 for name in STAGES}
+    for row in rows:
+        for name, seconds in row["stages"].items():
+            totals[name] = totals.get(name, 0.0) + seconds
+    summary = {
+        "files": len(rows),
+        "failed": sum(not row["ok"] for row in rows),
+        "cached": sum(row["cached"] for row in rows),
+        "wall_seconds": round(wall_seconds, 4),
+        "file_seconds": round(sum(row["seconds"] for row in rows), 4),
+        "encode_attempts": sum(len(row["attempts"]) for row in rows),
+        "stages": {name: round(seconds, 4) for name, seconds in totals.items()},
+    }
+
+    if os.path.splitext(path)[1].lower() == ".csv":
+        columns = ["input", "target", "ok", "cached", "seconds", *STAGES, "attempts", "size_kb", "max_size_kb",
+                   "crf", "fps", "frames", "unique_frames", "peak_memory_mb", "error"]
+        with open(path, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=columns)
+            writer.writeheader()
+            for row in rows:
+                writer.writerow({
+                    **{key: row[key] for key in columns if key in row and key != "attempts"},
+                    **{name: row["stages"].get(name, 0.0) for name in STAGES},
+                    "attempts": len(row["attempts"]),
+                })
+            writer.writerow({
+                "input": "TOTAL",
+                "ok": summary["files"] - summary["failed"],
+                "cached": summary["cached"],
+                "seconds": summary["file_seconds"],
+                **summary["stages"],
+                "attempts": summary["encode_attempts"],
+            })
+    else:
+        with open(path, "w") as f:
+            json.dump({"summary": summary, "files": rows}, f, indent=2)
+
+
+def profile_call(mode, output_base, fn, *args, **kwargs):
+    """Run fn under cProfile or tracemalloc, saving stats next to output_base.
+
+    cprofile writes <output_base>.prof (open with pstats or snakeviz);
+    tracemalloc writes the top allocation sites to <output_base>.tracemalloc.txt.
+    """
+    if mode == "cprofile":
+        profiler = cProfile.Profile()
+        try:
+            return profiler.runcall(fn, *args, **kwargs)
+        finally:
+            profiler.dump_stats(output_base + ".prof")
+
+    tracemalloc.start(25)
+    try:
+        return fn(*args, **kwargs)
+    finally:
+        snapshot = tracemalloc.take_snapshot()
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        with open(output_base + ".tracemalloc.txt", "w") as f:
+            f.write(f"current={current / 1024:.1f} KB peak={peak / 1024:.1f} KB (Python allocations only)\n\n")
+            for stat in snapshot.statistics("lineno")[:30]:
+                f.write(f"{stat}\n")